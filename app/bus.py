@@ -0,0 +1,121 @@
+"""
+Шина событий для app.notifications.
+
+Сокеты админки живут в процессе веб-воркера, а события рождаются и там, и в
+процессе приёма апдейтов бота. Шина доставляет publish(user_id, message) во
+все процессы, где может быть нужное соединение:
+
+- local  — в пределах одного процесса (по умолчанию, режим `python -m app.main`);
+- sqlite — через таблицу bus_events в общей БД: publish пишет строку, каждый
+  веб-процесс опрашивает новые строки раз в NOTIFY_POLL_INTERVAL секунд.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import delete, func, insert, select
+
+from app.config import config
+from app.deps import engine, read_engine
+from app.storage.models import BusEvent
+
+log = logging.getLogger(__name__)
+
+Deliver = Callable[[Optional[int], dict], Awaitable[bool]]
+
+
+class LocalBus:
+    """Доставка внутри процесса: publish сразу вызывает локальную доставку."""
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def publish(self, user_id: Optional[int], message: dict) -> bool:
+        return await self.deliver(user_id, message)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class SQLiteBus:
+    """Доставка между процессами через таблицу bus_events общей SQLite-базы."""
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+        self.last_id = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, user_id: Optional[int], message: dict) -> bool:
+        async with engine.begin() as conn:
+            await conn.execute(
+                insert(BusEvent).values(
+                    user_id=user_id,
+                    payload=json.dumps(message),
+                    created_at=datetime.utcnow(),
+                )
+            )
+        return True
+
+    async def start(self):
+        if self._task is not None:
+            return
+        async with read_engine.connect() as conn:
+            res = await conn.execute(select(func.max(BusEvent.id)))
+            self.last_id = res.scalar() or 0  # старые события не переигрываем
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self):
+        polls = 0
+        while True:
+            rows = []
+            try:
+                async with read_engine.connect() as conn:
+                    res = await conn.execute(
+                        select(BusEvent.id, BusEvent.user_id, BusEvent.payload)
+                        .where(BusEvent.id > self.last_id)
+                        .order_by(BusEvent.id)
+                        .limit(500)
+                    )
+                    rows = res.all()
+                for event_id, user_id, payload in rows:
+                    self.last_id = event_id
+                    await self.deliver(user_id, json.loads(payload))
+
+                polls += 1
+                if polls % 200 == 0:
+                    await self._prune()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("[bus] poll error:", e)
+
+            if not rows:
+                await asyncio.sleep(config.NOTIFY_POLL_INTERVAL)
+
+    async def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=config.NOTIFY_RETENTION)
+        async with engine.begin() as conn:
+            await conn.execute(delete(BusEvent).where(BusEvent.created_at < cutoff))
+
+
+def create_bus(deliver: Deliver):
+    backend = (config.NOTIFY_BACKEND or "local").lower()
+    if backend == "sqlite":
+        return SQLiteBus(deliver)
+    if backend != "local":
+        log.warning("unknown NOTIFY_BACKEND=%r, falling back to local", backend)
+    return LocalBus(deliver)
@@ -0,0 +1,157 @@
+"""
+Журнал изменений диалогов для докачки после переподключения сокета.
+
+Каждый кадр диалога о новом сообщении или смене статуса получает номер seq
+(AUTOINCREMENT в таблице dialog_changes — общий для всех процессов и
+монотонный) и сохраняется перед публикацией. Клиент помнит последний
+увиденный seq и после переподключения присылает {"action": "resume", "seq": N};
+в ответ — один кадр resync со всеми пропущенными изменениями, либо
+{"reload": true}, если разрыв старше CHANGES_RETENTION или длиннее
+RESYNC_MAX_CHANGES.
+
+Записи копятся в очереди и пишутся одной транзакцией всё, что успело
+накопиться, — без дополнительного ожидания, когда очередь пуста.
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, text
+
+from app.config import config
+from app.deps import SessionLocal
+from app.storage.models import DialogChange
+
+log = logging.getLogger(__name__)
+
+# кадры, которые нужно докачивать; остальное (прогресс загрузок, очистки) — нет
+JOURNALED_ACTIONS = {"message", "status_update", "status_batch"}
+
+MAX_BATCH = 500
+PRUNE_INTERVAL = 60
+
+
+class ChangeJournal:
+
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+
+    def start(self):
+        if self._task is None:
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать очередь и остановить запись."""
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+
+    async def record(self, user_id: int, frame: dict) -> int:
+        """Сохранить кадр и вернуть присвоенный ему seq."""
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((user_id, frame, fut))
+        return await fut
+
+    async def _run(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < MAX_BATCH and not self.queue.empty():
+                nxt = self.queue.get_nowait()
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            try:
+                seqs = await self._write(batch)
+            except Exception as e:
+                log.exception("dialog change journal write failed")
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for (_, _, fut), seq in zip(batch, seqs):
+                    if not fut.done():
+                        fut.set_result(seq)
+
+            if time.monotonic() - self._pruned_at > PRUNE_INTERVAL:
+                await self._prune()
+            if stop:
+                return
+
+    async def _write(self, batch) -> List[int]:
+        now = datetime.utcnow()
+        seqs = []
+        async with SessionLocal() as session:
+            for user_id, frame, _ in batch:
+                result = await session.execute(
+                    insert(DialogChange).values(user_id=user_id, payload=json.dumps(frame), created_at=now)
+                )
+                seqs.append(result.inserted_primary_key[0])
+            await session.commit()
+        return seqs
+
+    async def _prune(self):
+        self._pruned_at = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=config.CHANGES_RETENTION)
+        try:
+            async with SessionLocal() as session:
+                await session.execute(delete(DialogChange).where(DialogChange.created_at < cutoff))
+                await session.commit()
+        except Exception:
+            log.exception("dialog change journal prune failed")
+
+
+change_journal = ChangeJournal()
+
+
+async def current_seq(session) -> int:
+    """Последний выданный seq (даже если строки уже удалены из журнала)."""
+    try:
+        row = (await session.execute(
+            text("SELECT seq FROM sqlite_sequence WHERE name = 'dialog_changes'")
+        )).first()
+        if row is not None:
+            return int(row[0])
+    except Exception:
+        pass  # не SQLite или таблица ещё пуста
+    return int((await session.execute(select(func.max(DialogChange.seq)))).scalar() or 0)
+
+
+async def changes_since(session, user_id: int, seq: int) -> Tuple[Optional[List[dict]], int]:
+    """
+    Пропущенные кадры диалога после seq и последний seq.
+    None вместо списка — разрыв не восстановить (журнал уже почищен или слишком длинный).
+    Оба запроса идут в одной читающей транзакции, поэтому очистка между ними не мешает.
+    """
+    last = await current_seq(session)
+    if seq >= last:
+        return [], last
+
+    oldest = (await session.execute(select(func.min(DialogChange.seq)))).scalar()
+    floor = oldest if oldest is not None else last + 1
+    if seq + 1 < floor:
+        return None, last
+
+    rows = (await session.execute(
+        select(DialogChange.seq, DialogChange.payload)
+        .where(DialogChange.user_id == user_id, DialogChange.seq > seq)
+        .order_by(DialogChange.seq)
+        .limit(config.RESYNC_MAX_CHANGES + 1)
+    )).all()
+    if len(rows) > config.RESYNC_MAX_CHANGES:
+        return None, last
+    return [{**json.loads(payload), "seq": s} for s, payload in rows], last
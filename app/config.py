@@ -5,6 +5,114 @@ class Config(BaseSettings):
     ADMIN_NAME: str = "admin"
     ADMIN_PASSWORD: str = "admin"
     DB_URL: str = "sqlite+aiosqlite:///./bot.db"
+    TELEGRAM_API_BASE: str = ""  # свой Bot API сервер (или заглушка bench); пусто — api.telegram.org
+
+    # Метрики Prometheus на GET /metrics (см. app/metrics.py)
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = ""  # Authorization: Bearer <token>; без токена — только с сессией админки
+
+    # Трассировка SQL (см. app/storage/tracing.py): выключена по умолчанию
+    SQL_TRACE: bool = False
+    SQL_SLOW_MS: float = 100.0  # дольше — в лог вместе с EXPLAIN QUERY PLAN
+    SQL_EXPLAIN: bool = True
+    SQL_TRACE_MAX_STATEMENTS: int = 2000  # нормализованных запросов в статистике
+    SQL_TRACE_TOP: int = 50  # строк на странице /sql
+
+    # Сессии админки (см. app/sessions.py)
+    SESSION_FILE: str = "web/.admin_cache.json"
+    SESSION_PERSIST_INTERVAL: float = 5.0
+    SESSION_CACHE_SIZE: int = 10000
+
+    # Профиль SQLite (см. app/storage/sqlite.py)
+    SQLITE_WAL: bool = True
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_CACHE_SIZE_KB: int = 20000
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024
+    DB_WRITE_POOL_SIZE: int = 1
+    DB_READ_POOL_SIZE: int = 4
+
+    # Общий пул HTTP-соединений (media_proxy и прочие исходящие запросы)
+    HTTP_POOL_SIZE: int = 100
+    MEDIA_CHUNK_SIZE: int = 64 * 1024
+
+    # Локальный кэш медиа (0 байт — кэш выключен)
+    MEDIA_CACHE_DIR: str = "media_cache"
+    MEDIA_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    MEDIA_CACHE_MAX_FILE_BYTES: int = 20 * 1024 * 1024  # Bot API не отдаёт файлы больше 20 МБ
+    FILE_PATH_TTL: int = 50 * 60  # ссылка на файл живёт не меньше часа
+    FILE_PATH_CACHE_SIZE: int = 10000
+
+    # История диалога: размер первой страницы и максимум на запрос
+    DIALOG_PAGE_SIZE: int = 50
+    HISTORY_MAX_PAGE: int = 200
+    INDEX_PAGE_SIZE: int = 50
+    SEARCH_PAGE_SIZE: int = 20
+
+    # Шаблоны админки: компилируются при старте, байткод кэшируется на диске
+    TEMPLATE_CACHE_DIR: str = ".jinja_cache"  # пусто — без кэша байткода
+    TEMPLATE_AUTO_RELOAD: bool = False  # True — перечитывать изменённые шаблоны (разработка)
+
+    # Склейка изменений статусов в один кадр status_batch
+    STATUS_BATCH_WINDOW: float = 0.05  # секунды
+    STATUS_BATCH_MAX: int = 500
+
+    # Очередь исходящих кадров на одно WebSocket-соединение
+    WS_QUEUE_SIZE: int = 1000
+    WS_OVERFLOW_POLICY: str = "disconnect"  # disconnect | drop
+
+    # Шина уведомлений между процессами (см. app/bus.py)
+    NOTIFY_BACKEND: str = "local"  # local | sqlite
+    NOTIFY_POLL_INTERVAL: float = 0.05
+    NOTIFY_RETENTION: int = 60  # секунды хранения событий в bus_events
+
+    # Журнал изменений диалогов для докачки после переподключения (см. app/changes.py)
+    CHANGES_RETENTION: int = 24 * 60 * 60  # секунды; более старый разрыв — перезагрузка страницы
+    RESYNC_MAX_CHANGES: int = 500  # больше пропущенных изменений — тоже перезагрузка
+
+    # Групповая запись входящих сообщений (см. app/storage/writer.py)
+    WRITE_BEHIND: bool = False
+    WRITE_BATCH_MAX: int = 200
+    WRITE_BATCH_LATENCY_MS: int = 20
+
+    # Массовое удаление сообщений в Telegram (deleteMessages)
+    DELETE_BATCH_SIZE: int = 100  # больше 100 id Bot API не принимает
+    DELETE_CONCURRENCY: int = 4
+
+    # Планировщик исходящих вызовов Telegram (см. app/services/outbox.py)
+    TG_GLOBAL_RATE: float = 30  # сообщений в секунду на бота
+    TG_CHAT_RATE: float = 1  # сообщений в секунду на чат
+    TG_CHAT_BURST: int = 3
+    TG_MAX_INFLIGHT: int = 16
+    TG_MAX_RETRIES: int = 3  # повторов после 429
+
+    # Загрузка файлов админом
+    UPLOAD_DIR: str = "media"
+    UPLOAD_MAX_BYTES: int = 50 * 1024 * 1024  # предел Bot API на отправку файла
+    UPLOAD_MAX_FILES: int = 10  # файлов в одном запросе /upload_admin_file (альбом)
+    UPLOAD_CHUNK_SIZE: int = 1024 * 1024
+    UPLOAD_SEND_CONCURRENCY: int = 3
+
+    # Рассылки
+    CAMPAIGN_BATCH_SIZE: int = 50  # получателей на одну запись в БД
+    CAMPAIGN_POLL_INTERVAL: float = 2.0  # как часто искать рассылки без владельца
+    CAMPAIGN_LEASE_SECONDS: int = 60  # после падения процесса рассылку подхватят через столько секунд
+
+    # Архив: старые и удалённые сообщения уходят из messages в сжатые сегменты
+    ARCHIVE_DIR: str = "archive"
+    ARCHIVE_AFTER_DAYS: int = 180
+    ARCHIVE_DELETED_AFTER_DAYS: int = 1  # удалённые — как только перестают быть нужны интерфейсу
+    ARCHIVE_BATCH_SIZE: int = 5000
+    ARCHIVE_INTERVAL: int = 6 * 60 * 60  # секунд между проходами, 0 — только вручную
+    ARCHIVE_CACHE_SEGMENTS: int = 64  # распакованных сегментов в памяти
+
+    # Приём апдейтов: polling или webhook (POST на WEBHOOK_PATH веб-приложения)
+    BOT_MODE: str = "polling"  # polling | webhook
+    WEBHOOK_URL: str = ""  # публичный https-адрес; пусто — setWebhook не вызывается
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    WEBHOOK_SECRET: str = ""  # X-Telegram-Bot-Api-Secret-Token, обязателен в режиме webhook
+    WEBHOOK_CONCURRENCY: int = 32  # одновременно обрабатываемых апдейтов
+    WEBHOOK_MAX_PENDING: int = 1000  # сверх этого отвечаем 503, Telegram повторит позже
 
     class Config:
         env_file = ".env"
@@ -1,7 +1,42 @@
+from typing import Optional
+import aiohttp
 from aiogram import Bot
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from app.config import config
+from app.metrics import TelegramMetrics
+from app.storage.sqlite import create_engines
+from app.storage.tracing import install_tracer
 
-bot = Bot(token=config.BOT_TOKEN)
-engine = create_async_engine(config.DB_URL, echo=False, future=True)
+telegram_api = TelegramAPIServer.from_base(config.TELEGRAM_API_BASE) if config.TELEGRAM_API_BASE else PRODUCTION
+bot = Bot(token=config.BOT_TOKEN, session=AiohttpSession(api=telegram_api))
+bot.session.middleware(TelegramMetrics())
+# engine — единственный писатель; read_engine — пул только для чтения (запросы админки)
+engine, read_engine = create_engines(config.DB_URL)
 SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(bind=read_engine, expire_on_commit=False)
+if config.SQL_TRACE:
+    install_tracer(engine, read_engine)
+
+# Долгоживущая HTTP-сессия создаётся лениво, когда уже есть event loop
+_http: Optional[aiohttp.ClientSession] = None
+
+
+def get_http() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия с пулом соединений (keep-alive к api.telegram.org)."""
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=config.HTTP_POOL_SIZE, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60),
+        )
+    return _http
+
+
+async def close_http():
+    """Закрывает общую HTTP-сессию (при остановке приложения)."""
+    global _http
+    if _http is not None and not _http.closed:
+        await _http.close()
+    _http = None
@@ -1,11 +1,22 @@
 import sys, os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+import argparse
 import asyncio
 import logging
-from aiogram import Dispatcher
-from app.deps import bot, engine
-from app.storage.models import Base
-from app.routers import user
+from contextlib import asynccontextmanager
+from app.config import config
+from app.changes import change_journal
+from app.deps import bot, engine, close_http, SessionLocal
+from app.metrics import router as metrics_router
+from app.notifications import start_bus, stop_bus
+from app.sessions import sessions
+from app.services.campaigns import campaign_runner
+from app.services.outbox import outbox
+from app.storage.archive import start_archiver, stop_archiver
+from app.storage.migrations import upgrade_schema
+from app.storage.repo import conversations_need_backfill, rebuild_conversations
+from app.storage.writer import message_writer
+from app.webhook import get_dispatcher, setup_webhook, webhook_ingest, router as webhook_router
 from web import admin_panel
 import uvicorn
 from fastapi import FastAPI
@@ -13,7 +24,28 @@ from fastapi.staticfiles import StaticFiles
 
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    admin_panel.precompile_templates()
+    await sessions.start()
+    await start_bus()
+    await campaign_runner.start()
+    await start_archiver()
+    yield
+    await stop_archiver()
+    await webhook_ingest.stop()
+    if config.BOT_MODE == "webhook":
+        await message_writer.stop()
+    await campaign_runner.stop()
+    await change_journal.stop()
+    await stop_bus()
+    await outbox.stop()
+    await close_http()
+    await sessions.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount(
     "/static",
@@ -22,29 +54,85 @@ app.mount(
 )
 
 app.include_router(admin_panel.router)  # 👈 подключаем админскую панель
+app.add_exception_handler(admin_panel.AdminAuthRequired, admin_panel.auth_required_handler)
+app.add_exception_handler(admin_panel.UploadTooLarge, admin_panel.upload_too_large_handler)
+app.add_middleware(admin_panel.UploadSizeLimit)
+app.include_router(webhook_router)
+app.include_router(metrics_router)
 
 
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await upgrade_schema(engine)
+
+    # первая миграция на сводку диалогов — строим её по старым сообщениям
+    async with SessionLocal() as session:
+        if await conversations_need_backfill(session):
+            count = await rebuild_conversations(session)
+            logging.info("conversations backfilled: %s", count)
+
+    if config.BOT_MODE == "webhook":
+        await setup_webhook()
 
 
 async def run_bot():
-    dp = Dispatcher()
-    dp.include_router(user.router)
-    await on_startup()
-    await dp.start_polling(bot)
+    dp = get_dispatcher()
+    try:
+        # после работы в режиме webhook getUpdates вернёт конфликт
+        await bot.delete_webhook(drop_pending_updates=False)
+        await dp.start_polling(bot)
+    finally:
+        await message_writer.stop()
+        await change_journal.stop()
 
 
-async def run_web():
-    config = uvicorn.Config(app, host="0.0.0.0", port=8000)
+async def run_web(host: str = "0.0.0.0", port: int = 8000):
+    config = uvicorn.Config(app, host=host, port=port)
     server = uvicorn.Server(config)
     await server.serve()
 
 
 async def main():
-    await asyncio.gather(run_bot(), run_web())
+    await on_startup()
+    if config.BOT_MODE == "webhook":
+        # апдейты приходят POST-ом в то же веб-приложение
+        await run_web()
+    else:
+        await asyncio.gather(run_bot(), run_web())
+
+
+async def main_bot():
+    await on_startup()
+    await run_bot()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m app.main")
+    parser.add_argument(
+        "--mode", choices=("all", "bot", "web"), default="all",
+        help="all — бот и веб в одном процессе; bot — только приём апдейтов; web — только админка",
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="число процессов uvicorn (режим web)")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+
+    if args.mode != "all" and config.NOTIFY_BACKEND == "local":
+        logging.warning(
+            "NOTIFY_BACKEND=local: events from other processes will not reach this one, "
+            "use NOTIFY_BACKEND=sqlite when running bot and web separately"
+        )
+
+    if args.mode == "all":
+        asyncio.run(main())
+    elif args.mode == "bot":
+        if config.BOT_MODE == "webhook":
+            raise SystemExit("BOT_MODE=webhook: updates are served by --mode web, --mode bot is polling only")
+        asyncio.run(main_bot())
+    else:
+        # схему готовим один раз до запуска воркеров
+        asyncio.run(on_startup())
+        uvicorn.run("app.main:app", host=args.host, port=args.port, workers=args.workers)
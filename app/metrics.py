@@ -0,0 +1,287 @@
+"""
+Метрики процесса в текстовом формате Prometheus (GET /metrics).
+
+Счётчики, gauge и гистограммы с фиксированными корзинами — без внешних
+зависимостей и блокировок: значения меняются только из event loop, а
+наблюдение в гистограмму — bisect по корзинам и пара сложений. Gauge с
+функцией вычисляется только при опросе. Значения у каждого процесса свои:
+при --workers N Prometheus опрашивает каждый воркер отдельно.
+"""
+import hmac
+import inspect
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from fastapi import APIRouter, Request, Response
+
+from app.config import config
+from app.sessions import sessions
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# long polling getUpdates и загрузки файлов длятся дольше обычных вызовов
+TELEGRAM_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = tuple(16 * 1024 * 4 ** i for i in range(8))  # 16 КБ … 256 МБ
+
+Labels = Tuple[str, ...]
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, labelnames: Sequence[str], labels: Labels, extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return [f"{_series(self.name, self.labelnames, k)} {_fmt(v)}" for k, v in self.values.items()]
+
+
+class Gauge(Metric):
+    """Значение задаётся set() или вычисляется fn() при опросе ({labels: value} либо число)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), fn: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Labels, float] = {}
+        self.fn = fn
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+    def render(self) -> List[str]:
+        values = self.values
+        if self.fn is not None:
+            values = self.fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [f"{_series(self.name, self.labelnames, k)} {_fmt(v)}" for k, v in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма, число наблюдений]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, *labels: str):
+        """Декоратор корутины: её длительность уходит в гистограмму."""
+        def decorate(fn):
+            @wraps(fn)
+            async def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, *labels)
+            return timed
+        return decorate
+
+    def render(self) -> List[str]:
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                series = _series(f"{self.name}_bucket", self.labelnames, labels, f'le="{_fmt(bound)}"')
+                lines.append(f"{series} {cumulative}")
+            lines.append(f"{_series(f'{self.name}_sum', self.labelnames, labels)} {_fmt(total)}")
+            lines.append(f"{_series(f'{self.name}_count', self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), fn=None) -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames, fn))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            samples = metric.render()
+            if samples:
+                lines += metric.header() + samples
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# =========================
+#   МЕТРИКИ
+# =========================
+
+REPO_SECONDS = registry.histogram(
+    "repo_call_seconds", "Длительность вызовов app.storage.repo", ["function"],
+)
+TELEGRAM_SECONDS = registry.histogram(
+    "telegram_api_request_seconds", "Длительность запросов к Bot API", ["method", "outcome"], TELEGRAM_BUCKETS,
+)
+UPDATE_SECONDS = registry.histogram(
+    "bot_update_handling_seconds", "Обработка апдейта хендлером бота", ["handler", "outcome"],
+)
+WS_FRAMES_SENT = registry.counter(
+    "ws_frames_sent_total", "Кадров отправлено в WebSocket", ["kind"],
+)
+WS_FRAMES_DROPPED = registry.counter(
+    "ws_frames_dropped_total", "Кадров не принято: очередь соединения переполнена", ["kind", "policy"],
+)
+MEDIA_REQUESTS = registry.counter(
+    "media_proxy_requests_total", "Запросы /media_proxy по источнику ответа", ["result"],
+)
+MEDIA_BYTES = registry.counter(
+    "media_proxy_bytes_total", "Байт отдано /media_proxy", ["source"],
+)
+UPLOAD_BYTES = registry.histogram(
+    "admin_upload_bytes", "Размер файлов, загруженных админом", ["media_type"], SIZE_BUCKETS,
+)
+
+
+def _media_hit_ratio() -> float:
+    hits = MEDIA_REQUESTS.get("hit")
+    total = hits + MEDIA_REQUESTS.get("miss") + MEDIA_REQUESTS.get("stream")
+    return hits / total if total else 0.0
+
+
+registry.gauge("media_cache_hit_ratio", "Доля /media_proxy, отданных из локального кэша", fn=_media_hit_ratio)
+
+
+def instrument_coroutines(namespace: dict, histogram: Histogram, module: str, context: Optional[ContextVar] = None):
+    """
+    Обернуть все публичные корутины модуля таймером (метка — имя функции).
+    context — contextvar, в котором на время вызова лежит имя функции.
+    """
+    for name, fn in list(namespace.items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(fn) and fn.__module__ == module:
+            timed = histogram.time(name)(fn)
+            namespace[name] = _with_context(timed, context, name) if context is not None else timed
+
+
+def _with_context(fn, context: ContextVar, value: str):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        token = context.set(value)
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            context.reset(token)
+    return wrapper
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    """Middleware сессии aiogram: длительность каждого вызова Bot API по методу и исходу."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            outcome = type(e).__name__
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method.__api_method__, outcome)
+
+
+class HandlerMetrics(BaseMiddleware):
+    """Inner middleware роутера: время хендлера по имени и исходу."""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            name = getattr(data.get("handler"), "callback", None)
+            UPDATE_SECONDS.observe(time.perf_counter() - started, getattr(name, "__name__", "unknown"), outcome)
+
+
+# =========================
+#   HTTP
+# =========================
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request):
+    if not config.METRICS_ENABLED:
+        return Response(status_code=404)
+    if config.METRICS_TOKEN:
+        expected = f"Bearer {config.METRICS_TOKEN}".encode()
+        if not hmac.compare_digest(request.headers.get("authorization", "").encode(), expected):
+            return Response(status_code=401)
+    elif not sessions.is_authed(request.cookies.get("admin_token")):
+        # без токена метрики видит только админ, как и остальные страницы
+        return Response(status_code=401)
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
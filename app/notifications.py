@@ -1,61 +1,221 @@
-from typing import Dict, Optional
+from typing import Dict, Optional, Set
 from fastapi import WebSocket
 import json
 import asyncio
+from app.bus import create_bus
+from app.changes import change_journal, JOURNALED_ACTIONS
+from app.config import config
+from app.metrics import registry, WS_FRAMES_SENT, WS_FRAMES_DROPPED
 
-# Активные соединения WebSocket (user_id → WebSocket)
-active_connections: Dict[int, WebSocket] = {}
 
-# Lock создаём позже, когда появится event loop
-lock: Optional[asyncio.Lock] = None
+class Connection:
+    """
+    Одно WebSocket-соединение со своей ограниченной очередью исходящих кадров.
+    Очередь разбирает отдельная задача-писатель, поэтому медленный клиент
+    не задерживает отправку остальным.
+    """
 
+    def __init__(self, websocket: WebSocket, user_id: Optional[int]):
+        self.websocket = websocket
+        self.user_id = user_id  # None — общая лента всех диалогов
+        self.kind = "feed" if user_id is None else "dialog"
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=config.WS_QUEUE_SIZE)
+        self.closed = False
+        self.writer = asyncio.create_task(self._drain())
 
-async def ensure_lock():
-    """Создаёт Lock при первом использовании (если его ещё нет)."""
-    global lock
-    if lock is None:
-        lock = asyncio.Lock()
+    def offer(self, text: str) -> bool:
+        """Положить кадр в очередь без ожидания. False — кадр не принят."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            WS_FRAMES_DROPPED.inc(self.kind, config.WS_OVERFLOW_POLICY)
+            if config.WS_OVERFLOW_POLICY != "drop":
+                # клиент не успевает — отключаем, после переподключения он получит актуальное состояние
+                self.close(code=1013)
+            return False
 
+    async def _drain(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+                WS_FRAMES_SENT.inc(self.kind)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # соединение умерло — убираем его из реестра
+            self.close()
 
-async def register_ws(user_id: int, websocket: WebSocket):
-    """Регистрирует новое WebSocket-соединение."""
-    await ensure_lock()
-    async with lock:
-        active_connections[user_id] = websocket
+    def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        _discard(self)
+        if self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        if code is not None:
+            asyncio.create_task(self._close_socket(code))
 
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
 
-async def unregister_ws(user_id: int):
+
+# Активные соединения: user_id → все открытые вкладки этого диалога
+active_connections: Dict[int, Set[Connection]] = {}
+# Подписчики общей ленты событий всех диалогов
+feed_connections: Set[Connection] = set()
+
+# Накопленные изменения статусов (user_id → {msg_id: status}) и таймеры их отправки
+pending_statuses: Dict[int, Dict[int, str]] = {}
+flush_tasks: Dict[int, asyncio.Task] = {}
+
+
+def _ws_gauge(value):
+    def collect():
+        dialogs = [c for cs in active_connections.values() for c in cs]
+        return {("dialog",): sum(map(value, dialogs)), ("feed",): sum(map(value, feed_connections))}
+    return collect
+
+
+registry.gauge("ws_connections", "Открытые WebSocket-соединения", ["kind"], fn=_ws_gauge(lambda c: 1))
+registry.gauge("ws_queue_frames", "Кадров в очередях соединений", ["kind"], fn=_ws_gauge(lambda c: c.queue.qsize()))
+
+
+def _discard(conn: Connection):
+    if conn.user_id is None:
+        feed_connections.discard(conn)
+        return
+    conns = active_connections.get(conn.user_id)
+    if conns is not None:
+        conns.discard(conn)
+        if not conns:
+            active_connections.pop(conn.user_id, None)
+
+
+async def register_ws(user_id: int, websocket: WebSocket) -> Connection:
+    """Регистрирует новое WebSocket-соединение диалога (вкладок может быть несколько)."""
+    conn = Connection(websocket, user_id)
+    active_connections.setdefault(user_id, set()).add(conn)
+    return conn
+
+
+async def register_feed(websocket: WebSocket) -> Connection:
+    """Регистрирует подписчика общей ленты (события всех диалогов)."""
+    conn = Connection(websocket, None)
+    feed_connections.add(conn)
+    return conn
+
+
+async def unregister_ws(conn: Connection):
     """Удаляет WebSocket-соединение (при обрыве или закрытии)."""
-    await ensure_lock()
-    async with lock:
-        active_connections.pop(user_id, None)
+    conn.close()
+
+
+async def _deliver(user_id: Optional[int], message: dict) -> bool:
+    """
+    Доставить событие в соединения этого процесса: диалогу user_id и общей ленте
+    (user_id=None — всем). Кадр сериализуется один раз и только ставится в очереди.
+    """
+    if user_id is None:
+        text = json.dumps(message)
+        conns = [c for cs in active_connections.values() for c in cs] + list(feed_connections)
+        return any([conn.offer(text) for conn in conns])
+
+    delivered = False
+    conns = active_connections.get(user_id)
+    if conns:
+        text = json.dumps(message)
+        for conn in list(conns):
+            delivered = conn.offer(text) or delivered
+
+    if feed_connections:
+        text = json.dumps({**message, "user_id": user_id})
+        for conn in list(feed_connections):
+            delivered = conn.offer(text) or delivered
+    return delivered
+
+
+# Шина между процессами (см. app/bus.py); по умолчанию — доставка в этом же процессе
+bus = create_bus(_deliver)
+
+
+async def start_bus():
+    """Запустить приём событий шины (в процессе, который держит WebSocket-соединения)."""
+    await bus.start()
+
+
+async def stop_bus():
+    await bus.stop()
 
 
 async def send_to_user_ws(user_id: int, message: dict):
-    """Отправить сообщение в активное соединение конкретного user_id."""
-    await ensure_lock()
-    ws = active_connections.get(user_id)
-    if not ws:
-        return False
-    try:
-        await ws.send_text(json.dumps(message))
-        return True
-    except Exception:
-        # Если соединение умерло — удалить
-        await unregister_ws(user_id)
-        return False
+    """
+    Отправить сообщение во все соединения диалога user_id (в любом процессе).
+    Сообщения и статусы сначала получают seq в журнале изменений — по нему
+    клиент докачивает пропущенное после переподключения.
+    """
+    if message.get("action") in JOURNALED_ACTIONS:
+        try:
+            message = {**message, "seq": await change_journal.record(user_id, message)}
+        except Exception as e:
+            print("[change_journal] record failed:", e)
+    return await bus.publish(user_id, message)
 
 
 async def broadcast(message: dict):
     """Отправить сообщение всем активным соединениям."""
-    await ensure_lock()
-    text = json.dumps(message)
-    dead_users = []
-    async with lock:
-        for uid, ws in active_connections.items():
-            try:
-                await ws.send_text(text)
-            except Exception:
-                dead_users.append(uid)
-        for uid in dead_users:
-            active_connections.pop(uid, None)
+    await bus.publish(None, message)
+
+
+# =========================
+#   ПАКЕТНЫЕ СТАТУСЫ
+# =========================
+
+async def queue_statuses(user_id: int, updates: Dict[int, str]):
+    """
+    Поставить изменения статусов в очередь диалога.
+    Они уходят одним кадром status_batch через STATUS_BATCH_WINDOW секунд
+    или сразу, если накопилось STATUS_BATCH_MAX изменений.
+    """
+    pending = pending_statuses.setdefault(user_id, {})
+    for msg_id, status in updates.items():
+        pending[msg_id] = status  # для одного сообщения важен последний статус
+        if len(pending) >= config.STATUS_BATCH_MAX:
+            await flush_statuses(user_id)
+            pending = pending_statuses.setdefault(user_id, {})
+
+    if pending and user_id not in flush_tasks:
+        flush_tasks[user_id] = asyncio.create_task(_flush_later(user_id))
+
+
+async def queue_status(user_id: int, msg_id: int, status: str):
+    """Одно изменение статуса (см. queue_statuses)."""
+    await queue_statuses(user_id, {msg_id: status})
+
+
+async def _flush_later(user_id: int):
+    await asyncio.sleep(config.STATUS_BATCH_WINDOW)
+    flush_tasks.pop(user_id, None)
+    await flush_statuses(user_id)
+
+
+async def flush_statuses(user_id: int):
+    """Немедленно отправить накопленные статусы диалога одним кадром."""
+    task = flush_tasks.pop(user_id, None)
+    if task is not None and task is not asyncio.current_task():
+        task.cancel()
+
+    pending = pending_statuses.pop(user_id, None)
+    if not pending:
+        return
+
+    statuses: Dict[str, list] = {}
+    for msg_id, status in pending.items():
+        statuses.setdefault(status, []).append(msg_id)
+    await send_to_user_ws(user_id, {"action": "status_batch", "statuses": statuses})
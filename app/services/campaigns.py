@@ -0,0 +1,260 @@
+"""
+Массовые рассылки по всем известным пользователям.
+
+Рассылка и прогресс по каждому получателю хранятся в БД (campaigns,
+campaign_recipients). Фоновый CampaignRunner берёт активные рассылки в аренду,
+отправляет пачками через outbox в полосе BULK (лимиты Telegram соблюдает
+планировщик), а итоги пачки — статусы получателей и сообщения в истории
+диалогов — пишет одной транзакцией. Пока пачка идёт, аренда продлевается;
+потерявший аренду процесс останавливается и итоги не пишет. После перезапуска рассылка продолжается
+с оставшихся pending-получателей; повторно может уйти не больше одной
+незаписанной пачки.
+
+Файл загружается в Telegram один раз — первому получателю, дальше рассылка
+идёт по полученному file_id.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import FSInputFile
+
+from app.config import config
+from app.deps import SessionLocal, ReadSessionLocal
+from app.services.outbox import outbox, BULK
+from app.services.uploads import SEND_METHODS, sent_file_id, remove_file
+from app.storage.models import Campaign
+from app.storage.repo import (
+    claim_campaign, release_campaign, renew_campaign_lease, get_campaign, get_runnable_campaign_ids,
+    get_pending_recipients, record_campaign_batch, set_campaign_media, set_campaign_status,
+    remember_media_file,
+)
+
+# окно для расчёта текущей скорости, секунд
+RATE_WINDOW = 60
+
+Result = Tuple[int, Optional[int], Optional[str]]  # (user_id, tg_message_id, error)
+
+
+class CampaignRunner:
+
+    def __init__(self):
+        self.owner = uuid4().hex
+        self._active: Dict[int, asyncio.Task] = {}
+        self._progress: Dict[int, Deque[Tuple[float, int]]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- публичный интерфейс ----------
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = list(self._active.values())
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def wake(self):
+        """Проверить рассылки сейчас, не дожидаясь CAMPAIGN_POLL_INTERVAL."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def describe(self, campaign: Campaign) -> dict:
+        """Прогресс и скорость рассылки для админки."""
+        done = (campaign.sent or 0) + (campaign.failed or 0)
+        rate = self._recent_rate(campaign.id)
+        if rate is None and campaign.started_at and done:
+            end = campaign.finished_at or datetime.utcnow()
+            elapsed = (end - campaign.started_at).total_seconds()
+            rate = done / elapsed if elapsed > 0 else None
+        pending = max(0, (campaign.total or 0) - done)
+        return {
+            "id": campaign.id,
+            "status": campaign.status,
+            "text": (campaign.text or "")[:80],
+            "media_type": campaign.media_type,
+            "total": campaign.total or 0,
+            "sent": campaign.sent or 0,
+            "failed": campaign.failed or 0,
+            "pending": pending,
+            "rate": round(rate, 2) if rate else 0.0,
+            "eta_seconds": int(pending / rate) if rate and campaign.status == "running" else None,
+            "created_at": campaign.created_at.isoformat() if campaign.created_at else None,
+            "started_at": campaign.started_at.isoformat() if campaign.started_at else None,
+            "finished_at": campaign.finished_at.isoformat() if campaign.finished_at else None,
+            "local": campaign.id in self._active,
+        }
+
+    # ---------- внутреннее ----------
+
+    async def _run(self):
+        while True:
+            try:
+                async with ReadSessionLocal() as session:
+                    ids = await get_runnable_campaign_ids(session)
+                for campaign_id in ids:
+                    if campaign_id not in self._active:
+                        self._active[campaign_id] = asyncio.create_task(self._work(campaign_id))
+            except Exception:
+                logging.exception("campaign poll failed")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), config.CAMPAIGN_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self, campaign_id: int):
+        try:
+            while True:
+                # аренда продлевается каждую пачку; пауза/отмена тоже видна здесь
+                async with SessionLocal() as session:
+                    if not await claim_campaign(session, campaign_id, self.owner, config.CAMPAIGN_LEASE_SECONDS):
+                        return
+                    campaign = await get_campaign(session, campaign_id)
+
+                async with ReadSessionLocal() as session:
+                    recipients = await get_pending_recipients(session, campaign_id, config.CAMPAIGN_BATCH_SIZE)
+                if not recipients:
+                    async with SessionLocal() as session:
+                        await set_campaign_status(session, campaign_id, "done", ("running",))
+                    logging.info("campaign %s finished: sent=%s failed=%s", campaign_id, campaign.sent, campaign.failed)
+                    return
+
+                results = await self._send_batch(campaign, recipients)
+                if results is None:
+                    logging.warning("campaign %s: lease lost mid-batch, stopping", campaign_id)
+                    return
+
+                async with SessionLocal() as session:
+                    recorded = await record_campaign_batch(
+                        session, campaign, results, config.ADMIN_NAME or "admin", self.owner,
+                    )
+                if not recorded:
+                    logging.warning("campaign %s: lease lost before recording the batch, stopping", campaign_id)
+                    return
+                self._note(campaign_id, len(results))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("campaign %s worker failed", campaign_id)
+        finally:
+            self._active.pop(campaign_id, None)
+            try:
+                async with SessionLocal() as session:
+                    await release_campaign(session, campaign_id, self.owner)
+            except Exception:
+                logging.exception("campaign %s release failed", campaign_id)
+
+    async def _send_batch(self, campaign: Campaign, recipients: List[int]) -> Optional[List[Result]]:
+        """
+        Отправить пачку, продлевая аренду, пока она идёт (BULK уступает
+        интерактивным отправкам, 429 приостанавливает очередь — пачка может
+        идти дольше аренды). None — аренду забрал другой процесс: отправка
+        прервана, чтобы не слать тем же получателям дважды.
+        """
+        async def send() -> List[Result]:
+            results: List[Result] = []
+            pending = recipients
+            if campaign.media_type and not campaign.file_id:
+                results, pending = await self._upload_first(campaign, pending)
+            results += await asyncio.gather(*(self._deliver(campaign, uid) for uid in pending))
+            return results
+
+        batch = asyncio.create_task(send())
+        try:
+            while True:
+                done, _ = await asyncio.wait({batch}, timeout=config.CAMPAIGN_LEASE_SECONDS / 3)
+                if done:
+                    return batch.result()
+                async with SessionLocal() as session:
+                    if not await renew_campaign_lease(session, campaign.id, self.owner, config.CAMPAIGN_LEASE_SECONDS):
+                        return None
+        finally:
+            if not batch.done():
+                batch.cancel()
+                await asyncio.gather(batch, return_exceptions=True)
+
+    async def _send(self, campaign: Campaign, user_id: int, media):
+        if campaign.media_type:
+            method = SEND_METHODS.get(campaign.media_type, "send_document")
+            return await outbox.send(method, user_id, media, caption=campaign.text or None, priority=BULK)
+        return await outbox.send("send_message", user_id, campaign.text, priority=BULK)
+
+    async def _deliver(self, campaign: Campaign, user_id: int) -> Result:
+        try:
+            sent = await self._send(campaign, user_id, campaign.file_id)
+        except TelegramForbiddenError:
+            return user_id, None, "forbidden"  # бот заблокирован пользователем
+        except Exception as e:
+            return user_id, None, f"{type(e).__name__}: {e}"[:200]
+        return user_id, sent.message_id, None
+
+    async def _upload_first(self, campaign: Campaign, recipients: List[int]) -> Tuple[List[Result], List[int]]:
+        """
+        Загрузить файл первому доступному получателю и перейти на file_id.
+        Возвращает итоги этих попыток и оставшихся получателей пачки.
+        """
+        if not campaign.media_path or not os.path.exists(campaign.media_path):
+            async with SessionLocal() as session:
+                await set_campaign_status(session, campaign.id, "cancelled", ("running", "paused"))
+            raise FileNotFoundError(f"campaign {campaign.id}: media file is missing")
+
+        results: List[Result] = []
+        for idx, user_id in enumerate(recipients):
+            try:
+                sent = await self._send(campaign, user_id, FSInputFile(campaign.media_path))
+            except TelegramForbiddenError:
+                results.append((user_id, None, "forbidden"))
+                continue
+            except Exception as e:
+                results.append((user_id, None, f"{type(e).__name__}: {e}"[:200]))
+                continue
+
+            file_id = sent_file_id(sent, campaign.media_type)
+            results.append((user_id, sent.message_id, None))
+            if not file_id:
+                continue
+            async with SessionLocal() as session:
+                await set_campaign_media(session, campaign.id, file_id)
+                if campaign.sha256:
+                    await remember_media_file(session, campaign.sha256, campaign.media_type, file_id)
+            remove_file(campaign.media_path)
+            campaign.file_id, campaign.media_path = file_id, None
+            return results, recipients[idx + 1:]
+        return results, []
+
+    def _note(self, campaign_id: int, count: int):
+        now = time.monotonic()
+        points = self._progress.setdefault(campaign_id, deque())
+        points.append((now, count))
+        while points and points[0][0] < now - RATE_WINDOW:
+            points.popleft()
+
+    def _recent_rate(self, campaign_id: int) -> Optional[float]:
+        points = self._progress.get(campaign_id)
+        if not points or campaign_id not in self._active:
+            return None
+        now = time.monotonic()
+        recent = [(t, n) for t, n in points if t >= now - RATE_WINDOW]
+        if len(recent) < 2:
+            return None
+        elapsed = now - recent[0][0]
+        # первая точка — конец пачки, её сообщения ушли до начала окна
+        return sum(n for _, n in recent[1:]) / elapsed if elapsed > 0 else None
+
+
+campaign_runner = CampaignRunner()
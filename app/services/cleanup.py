@@ -1,19 +1,77 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Sequence
 from aiogram import Bot
-from app.storage.repo import delete_user_messages, delete_single_message
+from aiogram.exceptions import TelegramAPIError
+from app.config import config
+from app.services.outbox import outbox, BULK
+from app.storage.archive import mark_archive_deleted
+from app.storage.repo import delete_single_message, mark_messages_deleted, reset_conversation
 
-async def delete_user_history(bot: Bot, session, user_id: int, messages):
-    for msg in messages:
-        try:
-            if msg.tg_message_id:
-                await bot.delete_message(user_id, msg.tg_message_id)
-        except Exception:
-            pass
-    await delete_user_messages(session, user_id)
+# on_progress(сколько обработано, всего, id строк только что завершённой пачки)
+Progress = Callable[[int, int, List[int]], Awaitable[None]]
+
+
+async def _delete_batch(bot: Bot, chat_id: int, tg_ids: List[int]):
+    """
+    Один вызов deleteMessages (до 100 id) через общий планировщик в фоновой очереди;
+    RetryAfter он повторяет сам. Прочие ошибки Telegram не мешают пометить
+    строки удалёнными (как и раньше).
+    """
+    try:
+        # лимит на чат не применяем: удаление — не отправка сообщений
+        await outbox.call(None, bot.delete_messages, chat_id, tg_ids, priority=BULK)
+    except TelegramAPIError as e:
+        print(f"[cleanup] Telegram bulk delete failed: {e}")
+
+
+async def delete_messages_bulk(
+    bot: Bot,
+    session,
+    chat_id: int,
+    messages: Sequence,
+    on_progress: Optional[Progress] = None,
+):
+    """
+    Удалить сообщения у пользователя пачками по DELETE_BATCH_SIZE через
+    deleteMessages, не больше DELETE_CONCURRENCY пачек одновременно.
+    После каждой пачки её строки помечаются 'deleted' одним UPDATE.
+    messages — объекты с полями id и tg_message_id.
+    """
+    total = len(messages)
+    size = max(1, min(config.DELETE_BATCH_SIZE, 100))
+    batches = [messages[i:i + size] for i in range(0, total, size)]
+    sem = asyncio.Semaphore(config.DELETE_CONCURRENCY)
+    db_lock = asyncio.Lock()  # AsyncSession нельзя использовать из нескольких задач сразу
+    done = 0
+
+    async def run(batch):
+        nonlocal done
+        tg_ids = [m.tg_message_id for m in batch if m.tg_message_id]
+        if tg_ids:
+            async with sem:
+                await _delete_batch(bot, chat_id, tg_ids)
+
+        ids = [m.id for m in batch]
+        async with db_lock:
+            await mark_messages_deleted(session, ids)
+            await session.commit()
+            done += len(ids)
+            if on_progress:
+                await on_progress(done, total, ids)
+
+    await asyncio.gather(*(run(b) for b in batches))
+
+
+async def delete_user_history(bot: Bot, session, user_id: int, messages, on_progress: Optional[Progress] = None):
+    await delete_messages_bulk(bot, session, user_id, messages, on_progress)
+    await mark_archive_deleted(session, user_id)
+    await reset_conversation(session, user_id)
+    await session.commit()
 
 async def delete_one(bot: Bot, session, user_id: int, msg):
     try:
         if msg.tg_message_id:
-            await bot.delete_message(user_id, msg.tg_message_id)
+            await outbox.call(None, bot.delete_message, user_id, msg.tg_message_id)
     except Exception:
         pass
     await delete_single_message(session, msg.id)
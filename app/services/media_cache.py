@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+import aiofiles
+from app.config import config
+from app.deps import bot, get_http, telegram_api
+
+# =========================
+#   file_id → file_path (TTL)
+# =========================
+
+# file_id -> (file_path, file_size, expires_at)
+_paths: Dict[str, Tuple[str, Optional[int], float]] = {}
+_resolving: Dict[str, asyncio.Future] = {}
+
+
+def telegram_file_url(file_path: str) -> str:
+    return telegram_api.file_url(config.BOT_TOKEN, file_path)
+
+
+def _remember_path(file_id: str, file_path: str, file_size: Optional[int]):
+    now = time.monotonic()
+    if len(_paths) >= config.FILE_PATH_CACHE_SIZE:
+        for key in [k for k, v in _paths.items() if v[2] <= now]:
+            _paths.pop(key, None)
+        while len(_paths) >= config.FILE_PATH_CACHE_SIZE:
+            _paths.pop(next(iter(_paths)))
+    _paths[file_id] = (file_path, file_size, now + config.FILE_PATH_TTL)
+
+
+async def _get_file(file_id: str) -> Tuple[str, Optional[int]]:
+    tg_file = await bot.get_file(file_id)
+    _remember_path(file_id, tg_file.file_path, tg_file.file_size)
+    return tg_file.file_path, tg_file.file_size
+
+
+async def resolve_file(file_id: str) -> Tuple[str, Optional[int]]:
+    """
+    Вернуть (file_path, file_size) для file_id.
+    Результат get_file кэшируется на FILE_PATH_TTL секунд, одновременные
+    запросы одного file_id делают один вызов Bot API.
+    """
+    if "/" in file_id:
+        # старые записи содержат готовый file_path
+        return file_id, None
+
+    hit = _paths.get(file_id)
+    if hit and hit[2] > time.monotonic():
+        return hit[0], hit[1]
+
+    task = _resolving.get(file_id)
+    if task is None:
+        task = asyncio.ensure_future(_get_file(file_id))
+        _resolving[file_id] = task
+        task.add_done_callback(lambda _: _resolving.pop(file_id, None))
+    return await asyncio.shield(task)
+
+
+# =========================
+#   ДИСКОВЫЙ LRU-КЭШ
+# =========================
+
+class MediaCache:
+    """
+    Кэш содержимого файлов Telegram на диске с ограничением по объёму.
+    Файлы пишутся во временный *.part и атомарно переименовываются,
+    при превышении бюджета удаляются давно не использованные.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_file_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._index: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()  # key -> (name, size)
+        self._total = 0
+        self._loaded = False
+        self._lock: Optional[asyncio.Lock] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def key_for(file_id: str) -> str:
+        return hashlib.sha1(file_id.encode()).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def cacheable(self, file_size: Optional[int]) -> bool:
+        if not self.enabled:
+            return False
+        return file_size is None or file_size <= self.max_file_bytes
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".part"):
+                # недокачанные файлы от прошлого запуска
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            st = entry.stat()
+            entries.append((st.st_atime, entry.name, st.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name.split(".", 1)[0]] = (name, size)
+            self._total += size
+        self._evict()
+
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._loaded:
+                await asyncio.to_thread(self._scan)
+                self._loaded = True
+
+    def _evict(self, keep: Optional[str] = None):
+        while self._total > self.max_bytes and self._index:
+            key = next(iter(self._index))
+            if key == keep:
+                if len(self._index) == 1:
+                    break
+                self._index.move_to_end(key)
+                continue
+            name, size = self._index.pop(key)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    async def lookup(self, file_id: str) -> Optional[str]:
+        """Путь к закэшированному файлу (и отметка об использовании) или None."""
+        if not self.enabled:
+            return None
+        await self._ensure_loaded()
+        key = self.key_for(file_id)
+        hit = self._index.get(key)
+        if not hit:
+            return None
+        path = os.path.join(self.directory, hit[0])
+        if not os.path.exists(path):
+            self._index.pop(key, None)
+            self._total -= hit[1]
+            return None
+        self._index.move_to_end(key)
+        return path
+
+    async def fetch(self, file_id: str, file_path: str) -> str:
+        """
+        Скачать файл в кэш и вернуть локальный путь.
+        Одновременные запросы одного файла ждут одну загрузку.
+        """
+        await self._ensure_loaded()
+        key = self.key_for(file_id)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._download(key, file_path))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, key: str, file_path: str) -> str:
+        ext = os.path.splitext(file_path)[1]
+        name = f"{key}{ext}"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{uuid4().hex}.part"
+        size = 0
+        try:
+            async with get_http().get(telegram_file_url(file_path)) as resp:
+                if resp.status != 200:
+                    raise FileNotFoundError(f"telegram returned {resp.status} for {file_path}")
+                async with aiofiles.open(tmp_path, "wb") as out:
+                    async for chunk in resp.content.iter_chunked(config.MEDIA_CHUNK_SIZE):
+                        await out.write(chunk)
+                        size += len(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        old = self._index.pop(key, None)
+        if old:
+            self._total -= old[1]
+        self._index[key] = (name, size)
+        self._total += size
+        self._evict(keep=key)
+        return path
+
+
+def guess_media_type(path: str) -> str:
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+media_cache = MediaCache(
+    config.MEDIA_CACHE_DIR,
+    config.MEDIA_CACHE_MAX_BYTES,
+    config.MEDIA_CACHE_MAX_FILE_BYTES,
+)
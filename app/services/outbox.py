@@ -0,0 +1,263 @@
+"""
+Единый планировщик исходящих вызовов Telegram Bot API.
+
+Все отправки идут через outbox.send(...): вызовы ставятся в очередь по
+приоритетам (INTERACTIVE — ответы админа, BULK — массовые операции) и
+выпускаются с учётом лимитов Telegram — общий (~30 сообщений/с) и на чат
+(~1 сообщение/с с небольшим запасом). На 429 (TelegramRetryAfter) вызов
+возвращается в очередь и повторяется не раньше retry_after; на это время
+приостанавливаются и бакет чата, и общий.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.config import config
+from app.deps import bot
+
+INTERACTIVE = 0
+BULK = 1
+LANES = (INTERACTIVE, BULK)
+
+# сколько заданий в начале очереди просматривать в поисках готового чата
+SCAN_LIMIT = 200
+# сколько stop() ждёт уже начатые вызовы, прежде чем отменить их
+STOP_TIMEOUT = 5.0
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity про запас."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost: float = 1, now: Optional[float] = None) -> float:
+        """Через сколько секунд можно будет взять cost токенов (0 — уже можно)."""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < cost:
+            wait = max(wait, (cost - self.tokens) / self.rate)
+        return wait
+
+    def take(self, cost: float = 1):
+        self.tokens -= min(cost, self.capacity)
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (после 429 от Telegram)."""
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+@dataclass
+class Job:
+    chat_id: Optional[int]
+    method: Callable
+    args: Tuple
+    kwargs: Dict[str, Any]
+    priority: int
+    cost: float
+    future: asyncio.Future
+    attempts: int = 0
+    not_before: float = 0.0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class TelegramScheduler:
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.global_bucket = TokenBucket(config.TG_GLOBAL_RATE, config.TG_GLOBAL_RATE)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.lanes: Dict[int, Deque[Job]] = {lane: deque() for lane in LANES}
+        self.inflight = 0
+        self.counters = {"sent": 0, "failed": 0, "retried": 0}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()  # выполняющиеся _execute
+
+    # ---------- публичный интерфейс ----------
+
+    async def call(
+        self,
+        chat_id: Optional[int],
+        method: Callable,
+        *args,
+        priority: int = INTERACTIVE,
+        cost: float = 1,
+        **kwargs,
+    ):
+        """
+        Выполнить method(*args, **kwargs) в порядке очереди и вернуть результат.
+        chat_id=None — учитывается только общий лимит (например, удаление).
+        """
+        self._ensure_started()
+        job = Job(
+            chat_id=chat_id,
+            method=method,
+            args=args,
+            kwargs=kwargs,
+            priority=priority if priority in self.lanes else BULK,
+            cost=cost,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self.lanes[job.priority].append(job)
+        self._wakeup.set()
+        return await job.future
+
+    async def send(self, method_name: str, chat_id: int, *args, priority: int = INTERACTIVE, cost: float = 1, **kwargs):
+        """outbox.send("send_message", chat_id, text) — вызов метода бота через очередь."""
+        return await self.call(
+            chat_id, getattr(self.bot, method_name), chat_id, *args,
+            priority=priority, cost=cost, **kwargs,
+        )
+
+    def stats(self) -> dict:
+        """Глубина очередей и счётчики (для метрик и админки)."""
+        now = time.monotonic()
+        oldest = [now - lane[0].enqueued_at for lane in self.lanes.values() if lane]
+        return {
+            "queued_interactive": len(self.lanes[INTERACTIVE]),
+            "queued_bulk": len(self.lanes[BULK]),
+            "inflight": self.inflight,
+            "oldest_wait_seconds": max(oldest) if oldest else 0.0,
+            "chats_tracked": len(self.chat_buckets),
+            **self.counters,
+        }
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._running:
+            await asyncio.wait(set(self._running), timeout=STOP_TIMEOUT)
+            for task in list(self._running):
+                task.cancel()
+            await asyncio.gather(*self._running, return_exceptions=True)
+        for lane in self.lanes.values():
+            while lane:
+                job = lane.popleft()
+                if not job.future.done():
+                    job.future.cancel()
+
+    # ---------- внутреннее ----------
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(config.TG_MAX_INFLIGHT)
+            self._task = asyncio.create_task(self._run())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= 10000:
+                now = time.monotonic()
+                for cid in [c for c, b in self.chat_buckets.items() if b.idle(now)]:
+                    del self.chat_buckets[cid]
+            bucket = TokenBucket(config.TG_CHAT_RATE, config.TG_CHAT_BURST)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _pick(self) -> Tuple[Optional[Job], Optional[float]]:
+        """Следующее задание, которое можно выпустить сейчас, или (None, сколько ждать)."""
+        now = time.monotonic()
+        min_wait: Optional[float] = None
+
+        for lane_id in LANES:
+            lane = self.lanes[lane_id]
+            for idx, job in enumerate(lane):
+                if idx >= SCAN_LIMIT:
+                    break
+                wait = max(0.0, job.not_before - now)
+                if job.chat_id is not None:
+                    wait = max(wait, self._chat_bucket(job.chat_id).delay(job.cost, now))
+                wait = max(wait, self.global_bucket.delay(job.cost, now))
+                if wait <= 0:
+                    del lane[idx]
+                    if job.chat_id is not None:
+                        self._chat_bucket(job.chat_id).take(job.cost)
+                    self.global_bucket.take(job.cost)
+                    return job, None
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+        return None, min_wait
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            job, wait = self._pick()
+            if job is None:
+                self._slots.release()
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._execute(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _execute(self, job: Job):
+        self.inflight += 1
+        try:
+            if job.future.done():
+                return  # вызывающий уже не ждёт (отменён)
+            result = await job.method(*job.args, **job.kwargs)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except TelegramRetryAfter as e:
+            job.attempts += 1
+            if job.attempts > config.TG_MAX_RETRIES:
+                self.counters["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.counters["retried"] += 1
+                if job.chat_id is not None:
+                    self._chat_bucket(job.chat_id).pause(e.retry_after)
+                # 429 может означать и общий лимит бота — притормаживаем всю очередь
+                self.global_bucket.pause(e.retry_after)
+                job.not_before = time.monotonic() + e.retry_after
+                self.lanes[job.priority].appendleft(job)
+        except Exception as e:
+            self.counters["failed"] += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.counters["sent"] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.inflight -= 1
+            self._slots.release()
+            self._wakeup.set()
+
+
+outbox = TelegramScheduler(bot)
@@ -0,0 +1,102 @@
+"""
+Общие помощники для исходящих файлов админа: определение типа отправки,
+хэш содержимого для дедупликации, потоковая запись на диск и отправка
+прямо из спула загрузки.
+"""
+import hashlib
+import mimetypes
+import os
+from typing import Optional, Tuple
+
+import aiofiles
+from aiogram.types import InputFile
+from fastapi import UploadFile
+
+from app.config import config
+
+SEND_METHODS = {
+    "photo": "send_photo",
+    "video": "send_video",
+    "voice": "send_voice",
+    "audio": "send_audio",
+    "document": "send_document",
+}
+
+
+def detect_media_type(upload: UploadFile, file_path: str) -> str:
+    mime = upload.content_type or mimetypes.guess_type(upload.filename or "")[0]
+    if not mime:
+        mime = mimetypes.guess_type(file_path)[0]
+
+    if mime and mime.startswith("image/"):
+        return "photo"
+    if mime and mime.startswith("video/"):
+        return "video"
+    if mime and mime.startswith("audio/"):
+        return "voice" if "ogg" in mime else "audio"
+    return "document"
+
+
+def sent_file_id(sent, media_type: str) -> str:
+    """file_id отправленного вложения из ответа Telegram."""
+    if media_type == "photo":
+        return sent.photo[-1].file_id if getattr(sent, "photo", None) else ""
+    obj = getattr(sent, media_type if media_type in SEND_METHODS else "document", None)
+    return obj.file_id if obj else ""
+
+
+def remove_file(path: Optional[str]):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class UploadInputFile(InputFile):
+    """
+    Файл для Bot API из спула UploadFile, без копии в UPLOAD_DIR. Годится,
+    пока запрос не завершён (потом Starlette закрывает спул); каждое чтение —
+    с начала, поэтому повтор после 429 отправляет файл целиком.
+    """
+
+    def __init__(self, upload: UploadFile, filename: str):
+        super().__init__(filename=filename, chunk_size=config.UPLOAD_CHUNK_SIZE)
+        self.upload = upload
+
+    async def read(self, bot):
+        await self.upload.seek(0)
+        while chunk := await self.upload.read(self.chunk_size):
+            yield chunk
+
+
+async def hash_upload(f: UploadFile) -> Tuple[Optional[str], int]:
+    """
+    sha256 загрузки без записи на диск (читает спул UploadFile и перематывает его).
+    (None, -1) — превышен UPLOAD_MAX_BYTES.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while chunk := await f.read(config.UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > config.UPLOAD_MAX_BYTES:
+            return None, -1
+        digest.update(chunk)
+    await f.seek(0)
+    return digest.hexdigest(), size
+
+
+async def stage_to_disk(f: UploadFile, file_path: str) -> int:
+    """Копирует загрузку на диск кусками, не блокируя event loop. -1 — превышен лимит."""
+    size = 0
+    async with aiofiles.open(file_path, "wb") as out:
+        while chunk := await f.read(config.UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > config.UPLOAD_MAX_BYTES:
+                break
+            await out.write(chunk)
+    if size > config.UPLOAD_MAX_BYTES:
+        remove_file(file_path)
+        return -1
+    return size
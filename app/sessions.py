@@ -0,0 +1,137 @@
+"""
+Сессии админки в памяти.
+
+Проверенные токены (app.auth) кэшируются вместе со сроком действия, так что
+проверка на горячем пути — поиск в словаре без HMAC. Общий токен админки,
+который раньше читался и переписывался в web/.admin_cache.json на каждом
+запросе, тоже живёт в памяти: файл читается один раз при старте, а изменения
+сбрасываются на диск фоновой задачей раз в SESSION_PERSIST_INTERVAL секунд
+(и при остановке).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import aiofiles
+
+from app.auth import create_token, verify_token
+from app.config import config
+
+log = logging.getLogger(__name__)
+
+
+def token_expiry(token: str) -> float:
+    try:
+        return float(token.split(":", 1)[0])
+    except ValueError:
+        return 0.0
+
+
+class SessionStore:
+
+    def __init__(self, path: str, max_tokens: int):
+        self.path = path
+        self.max_tokens = max_tokens
+        self._verified: Dict[str, float] = {}  # token -> expiry (unix time)
+        self._data: dict = {}  # содержимое файла (общий токен и прочее)
+        self._loaded = False
+        self._dirty = False
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- проверка ----------
+
+    def verify(self, token: Optional[str]) -> bool:
+        """Токен действителен? Повторная проверка того же токена — только словарь."""
+        if not token:
+            return False
+        expiry = self._verified.get(token)
+        now = time.time()
+        if expiry is not None:
+            if expiry > now:
+                return True
+            self._verified.pop(token, None)
+            return False
+        if not verify_token(token):
+            return False
+        self._remember(token, now)
+        return True
+
+    def _remember(self, token: str, now: float):
+        if len(self._verified) >= self.max_tokens:
+            for t in [t for t, exp in self._verified.items() if exp <= now]:
+                del self._verified[t]
+            while len(self._verified) >= self.max_tokens:
+                self._verified.pop(next(iter(self._verified)))
+        self._verified[token] = token_expiry(token)
+
+    # ---------- общий токен админки ----------
+
+    def shared_token(self) -> Optional[str]:
+        """Сохранённый токен админки, если он ещё действителен."""
+        self._ensure_loaded()
+        token = self._data.get("token")
+        return token if self.verify(token) else None
+
+    def issue_shared(self) -> str:
+        """Выпустить новый общий токен (на диск попадёт при ближайшем сбросе)."""
+        self._ensure_loaded()
+        token = create_token()
+        self._data["token"] = token
+        self._dirty = True
+        self._remember(token, time.time())
+        return token
+
+    def is_authed(self, token: Optional[str]) -> bool:
+        return self.verify(token) or self.shared_token() is not None
+
+    # ---------- файл ----------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+        except Exception:
+            self._data = {}
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        try:
+            async with aiofiles.open(tmp, "w", encoding="utf-8") as f:
+                await f.write(json.dumps(self._data))
+            os.replace(tmp, self.path)
+        except OSError:
+            self._dirty = True
+            log.exception("session store flush failed")
+
+    async def start(self):
+        if self._task is None:
+            await asyncio.to_thread(self._ensure_loaded)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(config.SESSION_PERSIST_INTERVAL)
+            await self.flush()
+
+
+sessions = SessionStore(config.SESSION_FILE, config.SESSION_CACHE_SIZE)
@@ -0,0 +1,377 @@
+"""
+Холодный архив сообщений.
+
+Сообщения старше ARCHIVE_AFTER_DAYS и удалённые (старше
+ARCHIVE_DELETED_AFTER_DAYS) переносятся из messages в сжатые сегменты
+ARCHIVE_DIR/<user_id>/<YYYY-MM>-<n>.jsonl.gz — по пользователю и месяцу —
+а таблица archive_segments хранит для каждого файла диапазон ключей
+(created_at, id). Сегменты неизменяемы; каждый проход дописывает новые.
+
+Перенос атомарен относительно БД: пачка читается и файл пишется через
+читающее соединение, затем одной короткой транзакцией писателя удаляются
+строки и добавляется запись сегмента. Если строки уже забрал другой
+процесс (или они изменились), транзакция откатывается, а файл удаляется.
+
+История диалога читает архив насквозь (read_archive_page) — при прокрутке
+назад страницы продолжаются из сегментов. В полнотекстовый поиск архивные
+сообщения не попадают.
+
+    python -m app.storage.archive            # один проход сейчас
+    python -m app.storage.archive --stats    # сколько лежит в архиве
+"""
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import select, delete, update, or_, and_, func, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import config
+from app.storage.models import Message, ArchiveSegment
+
+Cursor = Tuple[datetime, int]
+
+FIELDS = ("id", "user_id", "username", "text", "tg_message_id", "created_at", "status", "file_id", "media_type")
+
+# сколько id удалять одним DELETE (лимит переменных SQLite)
+DELETE_CHUNK = 500
+
+
+@dataclass
+class ArchivedMessage:
+    """Сообщение из архива — те же поля, что у Message, только для чтения."""
+    id: int
+    user_id: int
+    username: Optional[str]
+    text: Optional[str]
+    tg_message_id: Optional[int]
+    created_at: datetime
+    status: Optional[str]
+    file_id: Optional[str]
+    media_type: Optional[str]
+    archived: bool = True
+
+
+# =========================
+#   ФАЙЛЫ СЕГМЕНТОВ
+# =========================
+
+def _encode(m: Message) -> str:
+    row = {f: getattr(m, f) for f in FIELDS}
+    row["created_at"] = m.created_at.isoformat() if m.created_at else None
+    return json.dumps(row, ensure_ascii=False)
+
+
+def _decode(line: str) -> ArchivedMessage:
+    row = json.loads(line)
+    created_at = row.get("created_at")
+    row["created_at"] = datetime.fromisoformat(created_at) if created_at else datetime.min
+    return ArchivedMessage(**{f: row.get(f) for f in FIELDS})
+
+
+def _write_segment(user_id: int, month: str, rows: List[Message]) -> Tuple[str, int]:
+    """Записать сегмент (*.part → rename). Возвращает (путь относительно ARCHIVE_DIR, размер)."""
+    rel = os.path.join(str(user_id), f"{month}-{uuid4().hex[:12]}.jsonl.gz")
+    path = os.path.join(config.ARCHIVE_DIR, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.part"
+    with gzip.open(tmp, "wt", encoding="utf-8") as out:
+        for m in rows:
+            out.write(_encode(m))
+            out.write("\n")
+    os.replace(tmp, path)
+    return rel, os.path.getsize(path)
+
+
+def _remove_segment(rel: str):
+    try:
+        os.remove(os.path.join(config.ARCHIVE_DIR, rel))
+    except OSError:
+        pass
+
+
+class SegmentCache:
+    """LRU распакованных сегментов: файлы неизменяемы, кэш не нужно сбрасывать."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items: "OrderedDict[str, List[ArchivedMessage]]" = OrderedDict()
+
+    def _load(self, rel: str) -> List[ArchivedMessage]:
+        with gzip.open(os.path.join(config.ARCHIVE_DIR, rel), "rt", encoding="utf-8") as f:
+            return [_decode(line) for line in f if line.strip()]
+
+    async def get(self, rel: str) -> List[ArchivedMessage]:
+        rows = self._items.get(rel)
+        if rows is not None:
+            self._items.move_to_end(rel)
+            return rows
+        rows = await asyncio.to_thread(self._load, rel)
+        self._items[rel] = rows
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+        return rows
+
+
+segment_cache = SegmentCache(config.ARCHIVE_CACHE_SEGMENTS)
+
+
+# =========================
+#   ЧТЕНИЕ
+# =========================
+
+def _older(key: Cursor, before: Optional[Cursor]) -> bool:
+    return before is None or key < before
+
+
+async def read_archive_page(
+    session: AsyncSession,
+    user_id: int,
+    before: Optional[Cursor],
+    limit: int,
+    newer_than: Optional[Cursor] = None,
+) -> List[ArchivedMessage]:
+    """
+    Архивные сообщения пользователя от новых к старым, строго старше before.
+    newer_than — ключ самого старого сообщения уже набранной горячей страницы:
+    сегменты целиком старше него не нужны, и чаще всего файлы не открываются вовсе.
+    """
+    q = select(ArchiveSegment).where(ArchiveSegment.user_id == user_id)
+    if before is not None:
+        ts, msg_id = before
+        q = q.where(
+            or_(
+                ArchiveSegment.first_created_at < ts,
+                and_(ArchiveSegment.first_created_at == ts, ArchiveSegment.first_id < msg_id),
+            )
+        )
+    if newer_than is not None:
+        ts, msg_id = newer_than
+        q = q.where(
+            or_(
+                ArchiveSegment.last_created_at > ts,
+                and_(ArchiveSegment.last_created_at == ts, ArchiveSegment.last_id > msg_id),
+            )
+        )
+    q = q.order_by(ArchiveSegment.last_created_at.desc(), ArchiveSegment.last_id.desc())
+    segments = (await session.execute(q)).scalars().all()
+
+    found: List[ArchivedMessage] = []
+    for seg in segments:
+        # сегменты могут пересекаться (удалённые уходят в архив раньше старых);
+        # дальше читать незачем, когда набрано limit строк новее этого сегмента
+        if len(found) >= limit and (seg.last_created_at, seg.last_id) < (found[limit - 1].created_at, found[limit - 1].id):
+            break
+        try:
+            rows = await segment_cache.get(seg.path)
+        except OSError:
+            logging.exception("archive segment %s is unreadable", seg.path)
+            continue
+        for m in rows:
+            if _older((m.created_at, m.id), before):
+                if seg.all_deleted and m.status != "deleted":
+                    m = ArchivedMessage(**{**m.__dict__, "status": "deleted"})
+                found.append(m)
+        found.sort(key=lambda m: (m.created_at, m.id), reverse=True)
+        del found[limit:]
+    return found
+
+
+async def read_archive_all(session: AsyncSession, user_id: int) -> List[ArchivedMessage]:
+    """Весь архив пользователя в хронологическом порядке."""
+    rows = await read_archive_page(session, user_id, None, sys.maxsize)
+    rows.reverse()
+    return rows
+
+
+async def has_archive(session: AsyncSession, user_id: int) -> bool:
+    q = select(ArchiveSegment.id).where(ArchiveSegment.user_id == user_id).limit(1)
+    return (await session.execute(q)).first() is not None
+
+
+async def mark_archive_deleted(session: AsyncSession, user_id: int):
+    """Очистка истории: архивные сообщения пользователя тоже считаются удалёнными (без commit)."""
+    await session.execute(
+        update(ArchiveSegment)
+        .where(ArchiveSegment.user_id == user_id)
+        .values(all_deleted=True)
+    )
+
+
+# =========================
+#   ПЕРЕНОС В АРХИВ
+# =========================
+
+async def select_batch(session: AsyncSession, now: datetime) -> List[Message]:
+    """Следующие до ARCHIVE_BATCH_SIZE сообщений для архива (по пользователю и времени)."""
+    old_cutoff = now - timedelta(days=config.ARCHIVE_AFTER_DAYS)
+    deleted_cutoff = now - timedelta(days=config.ARCHIVE_DELETED_AFTER_DAYS)
+    res = await session.execute(
+        select(Message)
+        .where(
+            or_(
+                Message.created_at < old_cutoff,
+                and_(Message.status == "deleted", Message.created_at < deleted_cutoff),
+            )
+        )
+        .order_by(Message.user_id, Message.created_at, Message.id)
+        .limit(config.ARCHIVE_BATCH_SIZE)
+    )
+    return list(res.scalars().all())
+
+
+async def archive_batch(read_factory, write_factory, now: Optional[datetime] = None) -> int:
+    """
+    Перенести в архив до ARCHIVE_BATCH_SIZE сообщений. Возвращает число
+    перенесённых (0 — переносить нечего).
+
+    Пачка читается и пишется в файлы через читающее соединение; писатель
+    (пул из одного соединения) занят только короткой транзакцией удаления
+    строк и записи сегментов. Если за это время строки удалил или изменил
+    кто-то ещё, транзакция откатывается, файлы удаляются (RuntimeError).
+    """
+    now = now or datetime.utcnow()
+    async with read_factory() as session:
+        rows = await select_batch(session, now)
+    if not rows:
+        return 0
+
+    groups: Dict[Tuple[int, str], List[Message]] = {
+        key: list(items)
+        for key, items in groupby(rows, key=lambda m: (m.user_id, m.created_at.strftime("%Y-%m")))
+    }
+    written: List[Tuple[Tuple[int, str], str, int]] = []
+    try:
+        for (user_id, month), items in groups.items():
+            rel, size = await asyncio.to_thread(_write_segment, user_id, month, items)
+            written.append(((user_id, month), rel, size))
+
+        async with write_factory() as session:
+            try:
+                # удаляем только строки в том виде, в каком они попали в файл
+                keys = [(m.id, m.status) for m in rows]
+                removed = 0
+                for i in range(0, len(keys), DELETE_CHUNK):
+                    result = await session.execute(
+                        delete(Message).where(tuple_(Message.id, Message.status).in_(keys[i:i + DELETE_CHUNK]))
+                    )
+                    removed += result.rowcount
+                if removed != len(keys):
+                    # параллельный архиватор или запись успели первыми — наши файлы лишние
+                    raise RuntimeError("archive batch raced with another writer")
+
+                for (user_id, month), rel, size in written:
+                    items = groups[(user_id, month)]
+                    session.add(ArchiveSegment(
+                        user_id=user_id,
+                        month=month,
+                        path=rel,
+                        count=len(items),
+                        bytes=size,
+                        first_created_at=items[0].created_at,
+                        first_id=items[0].id,
+                        last_created_at=items[-1].created_at,
+                        last_id=items[-1].id,
+                        created_at=now,
+                    ))
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
+    except BaseException:
+        for _, rel, _ in written:
+            _remove_segment(rel)
+        raise
+    return len(rows)
+
+
+async def archive_once(read_factory=None, write_factory=None) -> int:
+    """Один полный проход: переносить пачками, пока есть что переносить."""
+    if read_factory is None or write_factory is None:
+        from app.deps import ReadSessionLocal, SessionLocal
+        read_factory = read_factory or ReadSessionLocal
+        write_factory = write_factory or SessionLocal
+    total = 0
+    while True:
+        try:
+            moved = await archive_batch(read_factory, write_factory)
+        except RuntimeError as e:
+            logging.warning("archive: %s", e)
+            break
+        total += moved
+        if moved < config.ARCHIVE_BATCH_SIZE:
+            break
+    if total:
+        logging.info("archive: moved %s messages", total)
+    return total
+
+
+async def archive_stats(session: AsyncSession) -> dict:
+    row = (await session.execute(
+        select(func.count(ArchiveSegment.id), func.sum(ArchiveSegment.count), func.sum(ArchiveSegment.bytes))
+    )).one()
+    return {"segments": row[0] or 0, "messages": row[1] or 0, "bytes": row[2] or 0}
+
+
+# =========================
+#   ФОНОВЫЙ ЗАПУСК
+# =========================
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _run_periodically():
+    while True:
+        try:
+            await archive_once()
+        except Exception:
+            logging.exception("archive pass failed")
+        await asyncio.sleep(config.ARCHIVE_INTERVAL)
+
+
+async def start_archiver():
+    global _task
+    if _task is None and config.ARCHIVE_INTERVAL > 0:
+        _task = asyncio.create_task(_run_periodically())
+
+
+async def stop_archiver():
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
+
+
+async def main(stats: bool):
+    from app.deps import engine, read_engine, SessionLocal
+    from app.storage.migrations import upgrade_schema
+
+    await upgrade_schema(engine)
+    if not stats:
+        moved = await archive_once()
+        print(f"archived: {moved}")
+    async with SessionLocal() as session:
+        print(await archive_stats(session))
+    await engine.dispose()
+    await read_engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.storage.archive")
+    parser.add_argument("--stats", action="store_true", help="только показать размер архива")
+    asyncio.run(main(parser.parse_args().stats))
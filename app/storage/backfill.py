@@ -0,0 +1,24 @@
+"""
+Перестроить таблицу conversations по существующим сообщениям:
+
+    python -m app.storage.backfill
+"""
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+import asyncio
+from app.deps import engine, read_engine, SessionLocal
+from app.storage.migrations import upgrade_schema
+from app.storage.repo import rebuild_conversations
+
+
+async def main():
+    await upgrade_schema(engine)
+    async with SessionLocal() as session:
+        count = await rebuild_conversations(session)
+    await engine.dispose()
+    await read_engine.dispose()
+    print(f"conversations rebuilt: {count}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Версионированные миграции схемы БД.
+
+Миграция — модуль vNNNN_<описание>.py в этом пакете с функцией
+upgrade(conn), где conn — синхронный SQLAlchemy Connection (вызывается через
+run_sync внутри транзакции). Применённые версии пишутся в schema_version.
+
+Новые таблицы по-прежнему создаёт Base.metadata.create_all, поэтому миграции
+должны быть идемпотентны относительно него (IF NOT EXISTS, has_column и т.п.).
+
+    python -m app.storage.migrations            # применить недостающие
+    python -m app.storage.migrations --status   # показать состояние
+"""
+import importlib
+import logging
+import pkgutil
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.storage.models import Base
+
+log = logging.getLogger(__name__)
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
+    return any(r[1] == column for r in rows)
+
+
+def has_index(conn, name: str) -> bool:
+    row = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+    ).first()
+    return row is not None
+
+
+def has_autoincrement(conn, table: str) -> bool:
+    row = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).first()
+    return row is not None and "AUTOINCREMENT" in (row[0] or "").upper()
+
+
+def rebuild_table(conn, table: str):
+    """
+    Пересоздать таблицу по текущей модели (SQLite не меняет ограничения
+    через ALTER TABLE), сохранив строки и индексы, созданные миграциями.
+    Триггеры на таблице удаляются вместе со старой копией — их
+    пересоздаёт вызывающая миграция.
+    """
+    old = f"{table}__old"
+    indexes = conn.exec_driver_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,),
+    ).fetchall()
+    conn.exec_driver_sql(f"ALTER TABLE {table} RENAME TO {old}")
+    for name, _ in indexes:
+        conn.exec_driver_sql(f"DROP INDEX {name}")
+
+    model = Base.metadata.tables[table]
+    model.create(conn)
+    for name, sql in indexes:
+        if not has_index(conn, name):
+            conn.exec_driver_sql(sql)
+
+    old_columns = {r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({old})").fetchall()}
+    columns = ", ".join(c.name for c in model.columns if c.name in old_columns)
+    conn.exec_driver_sql(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}")
+    conn.exec_driver_sql(f"DROP TABLE {old}")
+
+
+def discover() -> List[Tuple[int, str]]:
+    """Все миграции пакета: [(версия, имя модуля)] по возрастанию версии."""
+    found = []
+    for mod in pkgutil.iter_modules(__path__):
+        if mod.name.startswith("v") and mod.name[1:5].isdigit():
+            found.append((int(mod.name[1:5]), mod.name))
+    found.sort()
+    versions = [v for v, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"duplicate migration versions: {versions}")
+    return found
+
+
+def _ensure_version_table(conn):
+    conn.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " name VARCHAR NOT NULL,"
+        " applied_at DATETIME NOT NULL)"
+    )
+
+
+async def applied_versions(engine: AsyncEngine) -> List[int]:
+    async with engine.begin() as conn:
+        await conn.run_sync(_ensure_version_table)
+        res = await conn.execute(text("SELECT version FROM schema_version ORDER BY version"))
+        return [row[0] for row in res.all()]
+
+
+async def migrate(engine: AsyncEngine) -> List[int]:
+    """
+    Применить все недостающие миграции, каждую в своей транзакции.
+    Возвращает список применённых версий.
+    """
+    done = set(await applied_versions(engine))
+    applied = []
+    for version, name in discover():
+        if version in done:
+            continue
+        module = importlib.import_module(f"{__name__}.{name}")
+        async with engine.begin() as conn:
+            await conn.run_sync(module.upgrade)
+            await conn.execute(
+                text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()},
+            )
+        log.info("migration applied: %s", name)
+        applied.append(version)
+    return applied
+
+
+async def upgrade_schema(engine: AsyncEngine) -> List[int]:
+    """Создать недостающие таблицы и применить миграции (при старте и из CLI)."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return await migrate(engine)
@@ -0,0 +1,29 @@
+import sys, os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
+import argparse
+import asyncio
+import logging
+
+from app.deps import engine, read_engine
+from app.storage.migrations import applied_versions, discover, upgrade_schema
+
+
+async def main():
+    parser = argparse.ArgumentParser(prog="python -m app.storage.migrations")
+    parser.add_argument("--status", action="store_true", help="показать применённые и ожидающие миграции")
+    args = parser.parse_args()
+
+    if args.status:
+        done = set(await applied_versions(engine))
+        for version, name in discover():
+            print(f"[{'x' if version in done else ' '}] {name}")
+    else:
+        applied = await upgrade_schema(engine)
+        print(f"applied: {applied or 'nothing to do'}")
+    await engine.dispose()
+    await read_engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,17 @@
+"""
+Составные индексы под горячие запросы:
+- отметка о прочтении в routers/user.py: (user_id, username, status);
+- постраничная история диалога: (user_id, created_at, id).
+"""
+
+
+def upgrade(conn):
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_username_status "
+        "ON messages (user_id, username, status)"
+    )
+    conn.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_messages_user_created_id "
+        "ON messages (user_id, created_at, id)"
+    )
+    conn.exec_driver_sql("ANALYZE messages")
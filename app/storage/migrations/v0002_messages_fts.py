@@ -0,0 +1,39 @@
+"""
+Полнотекстовый поиск по сообщениям: FTS5-индекс messages_fts поверх
+messages.text (external content — текст не дублируется) и триггеры,
+которые держат его в синхронизации при INSERT / UPDATE / DELETE.
+Префиксные индексы (2 и 3 символа) ускоряют поиск по недописанному слову.
+Существующие сообщения индексируются командой 'rebuild'.
+"""
+
+TRIGGERS = {
+    "messages_fts_ai": (
+        "AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); "
+        "END"
+    ),
+    "messages_fts_ad": (
+        "AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+        "END"
+    ),
+    "messages_fts_au": (
+        "AFTER UPDATE OF text ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); "
+        "END"
+    ),
+}
+
+
+def upgrade(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    conn.exec_driver_sql(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "text, content='messages', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    for name, body in TRIGGERS.items():
+        conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    conn.exec_driver_sql("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
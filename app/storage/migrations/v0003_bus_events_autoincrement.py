@@ -0,0 +1,12 @@
+"""
+bus_events с AUTOINCREMENT: без него SQLite выдаёт max(id)+1, и после
+очистки старых событий (SQLiteBus._prune) новые получали id, которые
+опрашивающие процессы уже считали прочитанными (id > last_id).
+"""
+from app.storage.migrations import has_autoincrement, rebuild_table
+
+
+def upgrade(conn):
+    if conn.dialect.name != "sqlite" or has_autoincrement(conn, "bus_events"):
+        return
+    rebuild_table(conn, "bus_events")
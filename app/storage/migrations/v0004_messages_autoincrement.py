@@ -0,0 +1,29 @@
+"""
+messages с AUTOINCREMENT: архивация (app/storage/archive.py) удаляет строки,
+и без него SQLite снова выдавал id удалённых сообщений, если среди них был
+максимальный. Повторный id путал историю (архив + живые строки), статусы
+и rowid в messages_fts.
+
+Таблица пересоздаётся с сохранением строк и индексов; триггеры FTS
+пересоздаются, индекс FTS не меняется (id те же). Счётчик id поднимается
+не ниже последнего id в архиве.
+"""
+from app.storage.migrations import has_autoincrement, rebuild_table
+from app.storage.migrations.v0002_messages_fts import TRIGGERS
+
+
+def upgrade(conn):
+    if conn.dialect.name != "sqlite" or has_autoincrement(conn, "messages"):
+        return
+    for name in TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {name}")
+    rebuild_table(conn, "messages")
+    for name, body in TRIGGERS.items():
+        conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+
+    archived = conn.exec_driver_sql("SELECT coalesce(max(last_id), 0) FROM archive_segments").scalar()
+    current = conn.exec_driver_sql("SELECT seq FROM sqlite_sequence WHERE name = 'messages'").scalar()
+    if current is None:
+        conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('messages', ?)", (archived,))
+    elif archived > current:
+        conn.exec_driver_sql("UPDATE sqlite_sequence SET seq = ? WHERE name = 'messages'", (archived,))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, Boolean
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 
@@ -6,6 +6,8 @@ Base = declarative_base()
 
 class Message(Base):
     __tablename__ = "messages"
+    # id не переиспользуется: архивация удаляет строки, а id живут в архиве, FTS и клиентах
+    __table_args__ = {"sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, index=True)
     username = Column(String)
@@ -15,3 +17,119 @@ class Message(Base):
     status = Column(String, default="sent")  # sent | delivered | read | deleted
     file_id = Column(String, nullable=True)
     media_type = Column(String, nullable=True)  # photo, video, document, voice
+
+
+class Conversation(Base):
+    """Сводка по диалогу для списка чатов (обновляется вместе с messages)."""
+    __tablename__ = "conversations"
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String, nullable=True)  # последний username собеседника
+    last_text = Column(Text, nullable=True)  # превью последнего сообщения
+    last_media_type = Column(String, nullable=True)
+    last_activity = Column(DateTime, default=datetime.utcnow)
+    unread_count = Column(Integer, default=0)  # сообщения пользователя, не открытые админом
+
+    __table_args__ = (
+        Index("ix_conversations_last_activity", "last_activity", "user_id"),
+    )
+
+
+class BusEvent(Base):
+    """
+    Событие межпроцессной шины уведомлений (NOTIFY_BACKEND=sqlite).
+    id не переиспользуется после очистки таблицы — читатели идут по id > last_id.
+    """
+    __tablename__ = "bus_events"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=True)  # None — broadcast
+    payload = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class MediaFile(Base):
+    """Уже загруженный в Telegram файл: sha256 содержимого → file_id для повторной отправки."""
+    __tablename__ = "media_files"
+    sha256 = Column(String(64), primary_key=True)
+    media_type = Column(String, primary_key=True)  # один и тот же файл как photo и как document — разные file_id
+    file_id = Column(String, nullable=False)
+    size = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+    use_count = Column(Integer, default=0)
+
+
+class Campaign(Base):
+    """Массовая рассылка одного сообщения/файла по всем известным пользователям."""
+    __tablename__ = "campaigns"
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, default="")
+    media_type = Column(String, nullable=True)
+    file_id = Column(String, nullable=True)  # появляется после первой загрузки в Telegram
+    media_path = Column(String, nullable=True)  # файл на диске до первой загрузки
+    sha256 = Column(String(64), nullable=True)
+    status = Column(String, default="running")  # running | paused | done | cancelled
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    owner = Column(String, nullable=True)  # процесс, который сейчас ведёт рассылку
+    lease_until = Column(DateTime, nullable=True)
+
+
+class CampaignRecipient(Base):
+    """Прогресс рассылки по конкретному получателю."""
+    __tablename__ = "campaign_recipients"
+    campaign_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    status = Column(String, default="pending")  # pending | sent | failed
+    tg_message_id = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_campaign_recipients_status", "campaign_id", "status", "user_id"),
+    )
+
+
+class ArchiveSegment(Base):
+    """
+    Сжатый файл с архивными сообщениями одного пользователя за месяц
+    (см. app/storage/archive.py). Первый/последний ключ (created_at, id) —
+    для чтения истории насквозь без открытия лишних файлов.
+    """
+    __tablename__ = "archive_segments"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    month = Column(String(7), nullable=False)  # YYYY-MM
+    path = Column(String, nullable=False)  # относительно ARCHIVE_DIR
+    count = Column(Integer, default=0)
+    bytes = Column(Integer, default=0)
+    first_created_at = Column(DateTime)
+    first_id = Column(Integer)
+    last_created_at = Column(DateTime)
+    last_id = Column(Integer)
+    all_deleted = Column(Boolean, default=False)  # история очищена после архивации
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_archive_segments_user_last", "user_id", "last_created_at", "last_id"),
+    )
+
+
+class DialogChange(Base):
+    """
+    Журнал изменений диалогов (новые сообщения, статусы) для докачки
+    после переподключения сокета. seq монотонен и не переиспользуется.
+    """
+    __tablename__ = "dialog_changes"
+    __table_args__ = (
+        Index("ix_dialog_changes_user_seq", "user_id", "seq"),
+        {"sqlite_autoincrement": True},
+    )
+    seq = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    payload = Column(Text, nullable=False)  # кадр WebSocket в JSON
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
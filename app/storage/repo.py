@@ -1,12 +1,26 @@
-from sqlalchemy import select, delete, update
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy import (
+    Integer, select, insert, delete, update, or_, and_, case, func, literal, literal_column,
+    table, column, text as sql_text,
+)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.storage.models import Message
+from app.config import config
+from app.metrics import REPO_SECONDS, instrument_coroutines
+from app.storage.tracing import repo_function
+from app.storage.models import Message, Conversation, MediaFile, Campaign, CampaignRecipient
+from app.storage.archive import read_archive_page, read_archive_all, mark_archive_deleted, has_archive
+
+Cursor = Tuple[datetime, int]
+
+PREVIEW_LENGTH = 200
 
 # =========================
 #   СОХРАНЕНИЕ / ЗАГРУЗКА
 # =========================
 
-async def save_message(
+async def add_message(
     session: AsyncSession,
     user_id: int,
     username: str,
@@ -14,8 +28,14 @@ async def save_message(
     tg_message_id: int,
     media_type: str = None,
     file_id: str = None,
-    status: str = "sent"
+    status: str = "sent",
+    bulk: bool = False,
 ):
+    """
+    Добавить сообщение и обновить сводку диалога без commit
+    (id появится после flush/commit вызывающей стороны).
+    bulk — массовая отправка: сводку существующего диалога не трогаем.
+    """
     m = Message(
         user_id=user_id,
         username=username,
@@ -24,8 +44,33 @@ async def save_message(
         media_type=media_type,
         file_id=file_id,
         status=status,
+        created_at=datetime.utcnow(),
     )
     session.add(m)
+    await touch_conversation(session, m, bulk=bulk)
+    return m
+
+
+async def save_message(
+    session: AsyncSession,
+    user_id: int,
+    username: str,
+    text: str,
+    tg_message_id: int,
+    media_type: str = None,
+    file_id: str = None,
+    status: str = "sent"
+):
+    m = await add_message(
+        session,
+        user_id=user_id,
+        username=username,
+        text=text,
+        tg_message_id=tg_message_id,
+        media_type=media_type,
+        file_id=file_id,
+        status=status,
+    )
     await session.commit()
     await session.refresh(m)
     return m
@@ -35,17 +80,256 @@ async def get_all_users(session: AsyncSession):
     """
     Получить всех пользователей, которые когда-либо писали.
     """
-    res = await session.execute(select(Message.user_id, Message.username).distinct())
+    res = await session.execute(select(Conversation.user_id, Conversation.username))
     return res.all()
 
 
 async def get_user_messages(session: AsyncSession, user_id: int):
     """
-    Получить все сообщения конкретного пользователя.
+    Получить все сообщения конкретного пользователя (включая архив).
     """
     res = await session.execute(select(Message).where(Message.user_id == user_id))
+    return await read_archive_all(session, user_id) + list(res.scalars().all())
+
+
+def encode_cursor(created_at: datetime, msg_id: int) -> str:
+    return f"{created_at.isoformat()}_{msg_id}"
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Cursor]:
+    """
+    Разобрать курсор вида '<created_at ISO>_<id>'. Пустой/битый курсор → None.
+    """
+    if not cursor:
+        return None
+    ts, _, msg_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(ts), int(msg_id)
+    except ValueError:
+        return None
+
+
+async def get_user_messages_page(
+    session: AsyncSession,
+    user_id: int,
+    before: Optional[Cursor] = None,
+    limit: int = 50,
+):
+    """
+    Страница истории пользователя от новых к старым (keyset по created_at, id).
+    before — курсор последнего (самого старого) сообщения предыдущей страницы.
+    """
+    q = select(Message).where(Message.user_id == user_id)
+    if before:
+        ts, msg_id = before
+        q = q.where(
+            or_(
+                Message.created_at < ts,
+                and_(Message.created_at == ts, Message.id < msg_id),
+            )
+        )
+    q = q.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+    res = await session.execute(q)
+    rows = list(res.scalars().all())
+
+    # архив читается насквозь: когда горячих строк не хватило или в архиве
+    # есть что-то новее последней из них (удалённые уходят туда раньше)
+    newer_than = (rows[-1].created_at, rows[-1].id) if len(rows) >= limit else None
+    archived = await read_archive_page(session, user_id, before, limit, newer_than)
+    if archived:
+        rows = sorted(rows + archived, key=lambda m: (m.created_at, m.id), reverse=True)[:limit]
+    return rows
+
+
+HISTORY_COLUMNS = (
+    Message.id, Message.username, Message.text, Message.created_at,
+    Message.status, Message.file_id, Message.media_type,
+)
+
+
+async def stream_latest_messages(session: AsyncSession, user_id: int, limit: int):
+    """
+    Последние limit сообщений в хронологическом порядке — курсором БД, без
+    материализации страницы. Возвращает (AsyncResult, курсор более старой
+    страницы или None) либо None, если у пользователя есть архив: такую
+    страницу собирает get_user_messages_page.
+    """
+    if await has_archive(session, user_id):
+        return None
+
+    # граница страницы — самое старое из limit последних; вторая строка
+    # показывает, есть ли что-то ещё старше
+    bound = (await session.execute(
+        select(Message.created_at, Message.id)
+        .where(Message.user_id == user_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .offset(limit - 1)
+        .limit(2)
+    )).all()
+
+    q = select(*HISTORY_COLUMNS).where(Message.user_id == user_id)
+    next_cursor = None
+    if bound:
+        ts, msg_id = bound[0]
+        # ">=" отдельно — иначе SQLite не берёт диапазон по индексу
+        q = q.where(
+            Message.created_at >= ts,
+            or_(Message.created_at > ts, Message.id >= msg_id),
+        )
+        if len(bound) > 1:
+            next_cursor = (ts, msg_id)
+    q = q.order_by(Message.created_at, Message.id)
+    return await session.stream(q), next_cursor
+
+
+async def get_dialog_username(session: AsyncSession, user_id: int, admin_name: str):
+    """
+    Username собеседника или None: из сводки диалога (один lookup по ключу),
+    а если там пусто — первое сообщение не от админа.
+    """
+    res = await session.execute(select(Conversation.username).where(Conversation.user_id == user_id))
+    username = res.scalar_one_or_none()
+    if username is None:
+        # в индексе (user_id, username) строки админа могут идти первыми —
+        # на длинном диалоге это скан, поэтому только как запасной путь
+        res = await session.execute(
+            select(Message.username)
+            .where(
+                Message.user_id == user_id,
+                Message.username != admin_name,
+                Message.username != "",
+            )
+            .limit(1)
+        )
+        username = res.scalar_one_or_none()
+    return username
+
+# =========================
+#       СПИСОК ДИАЛОГОВ
+# =========================
+
+async def touch_conversation(session: AsyncSession, m: Message, bulk: bool = False):
+    """
+    Обновить сводку диалога по новому сообщению (без commit — в транзакции save_message).
+    bulk=True (рассылка) только заводит сводку, если её нет: рассылка не ответ
+    админа — непрочитанные и место диалога в списке остаются прежними.
+    """
+    incoming = (m.username or "").lower() != (config.ADMIN_NAME or "admin").lower()
+    stmt = sqlite_insert(Conversation).values(
+        user_id=m.user_id,
+        username=(m.username or None) if incoming else None,
+        last_text=(m.text or "")[:PREVIEW_LENGTH],
+        last_media_type=m.media_type,
+        last_activity=m.created_at,
+        unread_count=1 if incoming else 0,
+    )
+    if bulk:
+        await session.execute(stmt.on_conflict_do_nothing(index_elements=[Conversation.user_id]))
+        return
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Conversation.user_id],
+        set_={
+            "username": func.coalesce(stmt.excluded.username, Conversation.username),
+            "last_text": stmt.excluded.last_text,
+            "last_media_type": stmt.excluded.last_media_type,
+            "last_activity": stmt.excluded.last_activity,
+            # ответ админа означает, что диалог прочитан
+            "unread_count": case(
+                (stmt.excluded.unread_count == 0, 0),
+                else_=Conversation.unread_count + stmt.excluded.unread_count,
+            ),
+        },
+    )
+    await session.execute(stmt)
+
+
+async def reset_conversation(session: AsyncSession, user_id: int):
+    """
+    Очистить превью и счётчик непрочитанных (после удаления истории, без commit).
+    """
+    await session.execute(
+        update(Conversation)
+        .where(Conversation.user_id == user_id)
+        .values(last_text=None, last_media_type=None, unread_count=0)
+    )
+
+
+async def mark_conversation_read(session: AsyncSession, user_id: int):
+    """
+    Сбросить счётчик непрочитанных (админ открыл диалог).
+    """
+    await session.execute(
+        update(Conversation)
+        .where(Conversation.user_id == user_id, Conversation.unread_count != 0)
+        .values(unread_count=0)
+    )
+    await session.commit()
+
+
+async def get_conversations(
+    session: AsyncSession,
+    before: Optional[Cursor] = None,
+    limit: int = 50,
+):
+    """
+    Страница списка диалогов, свежие сверху (keyset по last_activity, user_id).
+    """
+    q = select(Conversation)
+    if before:
+        ts, user_id = before
+        q = q.where(
+            or_(
+                Conversation.last_activity < ts,
+                and_(Conversation.last_activity == ts, Conversation.user_id < user_id),
+            )
+        )
+    q = q.order_by(Conversation.last_activity.desc(), Conversation.user_id.desc()).limit(limit)
+    res = await session.execute(q)
     return res.scalars().all()
 
+
+async def conversations_need_backfill(session: AsyncSession) -> bool:
+    """
+    True, если сообщения есть, а сводка диалогов ещё не построена.
+    """
+    has_conv = await session.execute(select(Conversation.user_id).limit(1))
+    if has_conv.first():
+        return False
+    has_msg = await session.execute(select(Message.id).limit(1))
+    return has_msg.first() is not None
+
+
+async def rebuild_conversations(session: AsyncSession) -> int:
+    """
+    Перестроить conversations по всей таблице messages (бэкфилл). Возвращает число диалогов.
+    """
+    await session.execute(delete(Conversation))
+    await session.execute(
+        sql_text(
+            """
+            INSERT INTO conversations
+                (user_id, username, last_text, last_media_type, last_activity, unread_count)
+            SELECT m.user_id,
+                   (SELECT u.username FROM messages u
+                     WHERE u.user_id = m.user_id
+                       AND lower(u.username) != lower(:admin) AND u.username != ''
+                     ORDER BY u.created_at DESC, u.id DESC LIMIT 1),
+                   CASE WHEN m.status = 'deleted' THEN NULL ELSE substr(m.text, 1, :preview) END,
+                   CASE WHEN m.status = 'deleted' THEN NULL ELSE m.media_type END,
+                   m.created_at,
+                   0
+              FROM messages m
+             WHERE m.id = (SELECT l.id FROM messages l
+                            WHERE l.user_id = m.user_id
+                            ORDER BY l.created_at DESC, l.id DESC LIMIT 1)
+            """
+        ),
+        {"admin": config.ADMIN_NAME or "admin", "preview": PREVIEW_LENGTH},
+    )
+    await session.commit()
+    res = await session.execute(select(func.count()).select_from(Conversation))
+    return res.scalar_one()
+
 # =========================
 #       УДАЛЕНИЕ (НОВАЯ ЛОГИКА)
 # =========================
@@ -59,9 +343,24 @@ async def delete_user_messages(session: AsyncSession, user_id: int):
         .where(Message.user_id == user_id)
         .values(status="deleted")
     )
+    await mark_archive_deleted(session, user_id)
+    await reset_conversation(session, user_id)
     await session.commit()
 
 
+async def mark_messages_deleted(session: AsyncSession, msg_ids: List[int]):
+    """
+    Пометить набор сообщений как 'deleted' одним UPDATE (без commit).
+    """
+    if not msg_ids:
+        return
+    await session.execute(
+        update(Message)
+        .where(Message.id.in_(msg_ids))
+        .values(status="deleted")
+    )
+
+
 async def delete_single_message(session: AsyncSession, msg_id: int):
     """
     Пометить одно сообщение как 'deleted' (не удаляя текст).
@@ -77,6 +376,18 @@ async def delete_single_message(session: AsyncSession, msg_id: int):
 #       ДОПОЛНИТЕЛЬНО
 # =========================
 
+async def get_deletable_messages(session: AsyncSession, user_id: int):
+    """
+    (id, tg_message_id) всех ещё не удалённых сообщений пользователя.
+    """
+    res = await session.execute(
+        select(Message.id, Message.tg_message_id)
+        .where(Message.user_id == user_id, Message.status != "deleted")
+        .order_by(Message.id)
+    )
+    return res.all()
+
+
 async def get_message_by_id(session: AsyncSession, msg_id: int):
     """
     Получить одно сообщение по ID.
@@ -85,6 +396,32 @@ async def get_message_by_id(session: AsyncSession, msg_id: int):
     return result.scalar_one_or_none()
 
 
+async def mark_admin_messages_read(session: AsyncSession, user_id: int) -> List[int]:
+    """
+    Пометить сообщения админа пользователю как 'read' (без commit).
+    Возвращает id только тех сообщений, у которых статус реально сменился.
+    """
+    cond = (
+        Message.user_id == user_id,
+        Message.username == config.ADMIN_NAME,
+        Message.status.in_(("sent", "delivered")),
+    )
+    if session.bind.dialect.update_returning:
+        # SQLite >= 3.35: UPDATE ... RETURNING за один запрос
+        res = await session.execute(
+            update(Message).where(*cond).values(status="read").returning(Message.id)
+        )
+        return [row[0] for row in res.all()]
+
+    res = await session.execute(select(Message.id).where(*cond))
+    ids = [row[0] for row in res.all()]
+    if ids:
+        await session.execute(
+            update(Message).where(Message.id.in_(ids)).values(status="read")
+        )
+    return ids
+
+
 async def update_message_status(session: AsyncSession, msg_id: int, new_status: str):
     """
     Обновить статус сообщения ('sent', 'delivered', 'read', 'deleted').
@@ -95,3 +432,391 @@ async def update_message_status(session: AsyncSession, msg_id: int, new_status:
         .values(status=new_status)
     )
     await session.commit()
+
+
+# =========================
+#   ДЕДУПЛИКАЦИЯ ИСХОДЯЩИХ ФАЙЛОВ
+# =========================
+
+async def get_media_file_id(session: AsyncSession, sha256: str, media_type: str) -> Optional[str]:
+    """
+    file_id ранее загруженного файла с тем же содержимым и типом отправки или None.
+    """
+    result = await session.execute(
+        select(MediaFile.file_id).where(
+            MediaFile.sha256 == sha256,
+            MediaFile.media_type == media_type,
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+async def remember_media_file(
+    session: AsyncSession,
+    sha256: str,
+    media_type: str,
+    file_id: str,
+    size: Optional[int] = None,
+):
+    """
+    Запомнить file_id для содержимого (или отметить повторное использование).
+    """
+    now = datetime.utcnow()
+    stmt = sqlite_insert(MediaFile).values(
+        sha256=sha256,
+        media_type=media_type,
+        file_id=file_id,
+        size=size,
+        created_at=now,
+        last_used_at=now,
+        use_count=1,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[MediaFile.sha256, MediaFile.media_type],
+        set_={
+            "file_id": stmt.excluded.file_id,
+            "last_used_at": stmt.excluded.last_used_at,
+            "use_count": MediaFile.use_count + 1,
+        },
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def forget_media_file(session: AsyncSession, sha256: str, media_type: str):
+    """
+    Удалить запись, если Telegram больше не принимает сохранённый file_id.
+    """
+    await session.execute(
+        delete(MediaFile).where(
+            MediaFile.sha256 == sha256,
+            MediaFile.media_type == media_type,
+        )
+    )
+    await session.commit()
+
+
+# =========================
+#   РАССЫЛКИ
+# =========================
+
+async def create_campaign(
+    session: AsyncSession,
+    text: str,
+    media_type: Optional[str] = None,
+    file_id: Optional[str] = None,
+    media_path: Optional[str] = None,
+    sha256: Optional[str] = None,
+) -> Campaign:
+    """
+    Создать рассылку и список получателей — всех пользователей из сводки диалогов.
+    """
+    campaign = Campaign(
+        text=text or "",
+        media_type=media_type,
+        file_id=file_id,
+        media_path=media_path,
+        sha256=sha256,
+        status="running",
+        created_at=datetime.utcnow(),
+    )
+    session.add(campaign)
+    await session.flush()
+
+    result = await session.execute(
+        insert(CampaignRecipient).from_select(
+            ["campaign_id", "user_id", "status"],
+            select(
+                literal(campaign.id),
+                Conversation.user_id,
+                literal("pending"),
+            ),
+        )
+    )
+    campaign.total = result.rowcount
+    await session.commit()
+    await session.refresh(campaign)
+    return campaign
+
+
+async def get_campaign(session: AsyncSession, campaign_id: int) -> Optional[Campaign]:
+    result = await session.execute(select(Campaign).where(Campaign.id == campaign_id))
+    return result.scalar_one_or_none()
+
+
+async def get_campaigns(session: AsyncSession, limit: int = 50):
+    result = await session.execute(
+        select(Campaign).order_by(Campaign.id.desc()).limit(limit)
+    )
+    return result.scalars().all()
+
+
+async def set_campaign_status(
+    session: AsyncSession, campaign_id: int, status: str, from_statuses: Tuple[str, ...]
+) -> bool:
+    """
+    Перевести рассылку в status, если она сейчас в одном из from_statuses.
+    """
+    values = {"status": status}
+    if status in ("done", "cancelled"):
+        values["finished_at"] = datetime.utcnow()
+    result = await session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.status.in_(from_statuses))
+        .values(**values)
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+
+async def set_campaign_media(session: AsyncSession, campaign_id: int, file_id: str):
+    """
+    Запомнить file_id после первой загрузки — дальше файл с диска не нужен.
+    """
+    await session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id)
+        .values(file_id=file_id, media_path=None)
+    )
+    await session.commit()
+
+
+async def get_runnable_campaign_ids(session: AsyncSession) -> List[int]:
+    """
+    Активные рассылки, которые никто не ведёт (или аренда истекла после падения процесса).
+    """
+    now = datetime.utcnow()
+    result = await session.execute(
+        select(Campaign.id)
+        .where(
+            Campaign.status == "running",
+            or_(Campaign.lease_until.is_(None), Campaign.lease_until < now),
+        )
+        .order_by(Campaign.id)
+    )
+    return list(result.scalars().all())
+
+
+async def claim_campaign(session: AsyncSession, campaign_id: int, owner: str, lease_seconds: float) -> bool:
+    """
+    Взять (или продлить) аренду рассылки. False — её ведёт другой процесс.
+    """
+    now = datetime.utcnow()
+    result = await session.execute(
+        update(Campaign)
+        .where(
+            Campaign.id == campaign_id,
+            Campaign.status == "running",
+            or_(
+                Campaign.owner.is_(None),
+                Campaign.owner == owner,
+                Campaign.lease_until.is_(None),
+                Campaign.lease_until < now,
+            ),
+        )
+        .values(
+            owner=owner,
+            lease_until=now + timedelta(seconds=lease_seconds),
+            started_at=func.coalesce(Campaign.started_at, now),
+        )
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+
+async def renew_campaign_lease(session: AsyncSession, campaign_id: int, owner: str, lease_seconds: float) -> bool:
+    """
+    Продлить аренду во время пачки (статус не важен — пачку пауза не прерывает).
+    False — аренду уже забрал другой процесс.
+    """
+    result = await session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.owner == owner)
+        .values(lease_until=datetime.utcnow() + timedelta(seconds=lease_seconds))
+    )
+    await session.commit()
+    return result.rowcount > 0
+
+
+async def release_campaign(session: AsyncSession, campaign_id: int, owner: str):
+    await session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign_id, Campaign.owner == owner)
+        .values(owner=None, lease_until=None)
+    )
+    await session.commit()
+
+
+async def get_pending_recipients(session: AsyncSession, campaign_id: int, limit: int) -> List[int]:
+    result = await session.execute(
+        select(CampaignRecipient.user_id)
+        .where(
+            CampaignRecipient.campaign_id == campaign_id,
+            CampaignRecipient.status == "pending",
+        )
+        .order_by(CampaignRecipient.user_id)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def record_campaign_batch(
+    session: AsyncSession,
+    campaign: Campaign,
+    results: List[Tuple[int, Optional[int], Optional[str]]],
+    admin_name: str,
+    owner: str,
+) -> bool:
+    """
+    Записать итоги пачки одной транзакцией: статусы получателей, сообщения
+    в истории диалогов и счётчики рассылки. results — (user_id, tg_message_id, error).
+    False — аренда у другого процесса, ничего не записано.
+    """
+    now = datetime.utcnow()
+    sent = sum(1 for _, _, error in results if error is None)
+    # счётчики первыми: проверка владельца и блокировка записи одной командой
+    owned = await session.execute(
+        update(Campaign)
+        .where(Campaign.id == campaign.id, Campaign.owner == owner)
+        .values(
+            sent=Campaign.sent + sent,
+            failed=Campaign.failed + (len(results) - sent),
+        )
+    )
+    if owned.rowcount == 0:
+        await session.rollback()
+        return False
+
+    updates = []
+    for user_id, tg_message_id, error in results:
+        if error is None:
+            await add_message(
+                session,
+                user_id=user_id,
+                username=admin_name,
+                text=campaign.text or "",
+                tg_message_id=tg_message_id,
+                media_type=campaign.media_type,
+                file_id=campaign.file_id,
+                status="delivered",
+                bulk=True,
+            )
+        updates.append({
+            "campaign_id": campaign.id,
+            "user_id": user_id,
+            "status": "sent" if error is None else "failed",
+            "tg_message_id": tg_message_id,
+            "error": error,
+            "sent_at": now,
+        })
+
+    if updates:
+        await session.execute(update(CampaignRecipient), updates)
+    await session.commit()
+    return True
+
+
+# =========================
+#   ПОЛНОТЕКСТОВЫЙ ПОИСК (FTS5)
+# =========================
+
+# маркеры подсветки в snippet(); в HTML их заменяет вызывающая сторона после экранирования
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+messages_fts = table("messages_fts", column("rowid", Integer))
+_fts = literal_column("messages_fts")
+
+
+def fts_query(raw: str) -> str:
+    """
+    Пользовательский ввод → безопасный запрос FTS5: каждое слово в кавычках,
+    все слова обязательны, последнее ищется по префиксу (его ещё дописывают).
+    """
+    terms = [f'"{t}"' for t in (w.replace('"', '""') for w in raw.split() if w.strip('"'))]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def encode_search_cursor(rank: Optional[float], msg_id: int) -> str:
+    return f"{msg_id}" if rank is None else f"{rank!r}_{msg_id}"
+
+
+def decode_search_cursor(cursor: Optional[str]) -> Optional[Tuple[Optional[float], int]]:
+    if not cursor:
+        return None
+    try:
+        if "_" in cursor:
+            rank, msg_id = cursor.rsplit("_", 1)
+            return float(rank), int(msg_id)
+        return None, int(cursor)
+    except ValueError:
+        return None
+
+
+async def search_messages(
+    session: AsyncSession,
+    query: str,
+    user_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    media_type: Optional[str] = None,
+    status: Optional[str] = None,
+    sort: str = "rank",
+    after: Optional[Tuple[Optional[float], int]] = None,
+    limit: int = 20,
+):
+    """
+    Поиск по тексту сообщений всех диалогов. sort="rank" — по релевантности
+    (bm25, затем id), sort="date" — сначала новые. after — курсор
+    (rank, id) последней строки предыдущей страницы.
+    """
+    match = fts_query(query)
+    if not match:
+        return []
+
+    rank = func.bm25(_fts)
+    stmt = (
+        select(
+            Message.id,
+            Message.user_id,
+            Message.username,
+            Message.created_at,
+            Message.media_type,
+            Message.status,
+            func.snippet(_fts, 0, MARK_START, MARK_END, "…", 16).label("snippet"),
+            rank.label("rank"),
+        )
+        .select_from(messages_fts.join(Message, Message.id == messages_fts.c.rowid))
+        .where(_fts.op("MATCH")(match))
+    )
+
+    if user_id is not None:
+        stmt = stmt.where(Message.user_id == user_id)
+    if date_from is not None:
+        stmt = stmt.where(Message.created_at >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Message.created_at < date_to)
+    if media_type:
+        stmt = stmt.where(Message.media_type == media_type)
+    if status:
+        stmt = stmt.where(Message.status == status)
+
+    if sort == "date":
+        # по rowid FTS5 идёт по индексу в нужном порядке и останавливается на LIMIT
+        if after is not None:
+            stmt = stmt.where(messages_fts.c.rowid < after[1])
+        stmt = stmt.order_by(messages_fts.c.rowid.desc())
+    else:
+        if after is not None and after[0] is not None:
+            stmt = stmt.where(or_(rank > after[0], and_(rank == after[0], Message.id > after[1])))
+        stmt = stmt.order_by(rank, Message.id)
+
+    result = await session.execute(stmt.limit(limit))
+    return result.all()
+
+
+# длительность каждой публичной корутины модуля — repo_call_seconds{function};
+# при SQL_TRACE имя функции видно трассировщику запросов
+instrument_coroutines(globals(), REPO_SECONDS, __name__, repo_function if config.SQL_TRACE else None)
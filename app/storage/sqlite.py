@@ -0,0 +1,76 @@
+"""
+Профиль SQLite-движка.
+
+Один движок-писатель (пул на DB_WRITE_POOL_SIZE соединений, по умолчанию одно —
+SQLite всё равно пишет последовательно, а так запись ждёт в пуле, а не на
+"database is locked") и отдельный пул читателей для запросов админки.
+В режиме WAL читатели не блокируют запись и наоборот.
+"""
+from typing import Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from app.config import config
+
+
+def _pragmas(readonly: bool):
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(config.SQLITE_BUSY_TIMEOUT_MS)}",
+        f"PRAGMA cache_size = -{int(config.SQLITE_CACHE_SIZE_KB)}",
+        f"PRAGMA mmap_size = {int(config.SQLITE_MMAP_SIZE)}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if readonly:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        if config.SQLITE_WAL:
+            pragmas.append("PRAGMA journal_mode = WAL")
+        pragmas.append(f"PRAGMA synchronous = {config.SQLITE_SYNCHRONOUS}")
+    return pragmas
+
+
+def _install_pragmas(engine: AsyncEngine, readonly: bool):
+    pragmas = _pragmas(readonly)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def create_engines(url: str) -> Tuple[AsyncEngine, AsyncEngine]:
+    """
+    (писатель, читатель) для DB_URL. Для не-SQLite и in-memory баз
+    оба — один и тот же движок без дополнительных настроек.
+    """
+    parsed = make_url(url)
+    if not parsed.get_backend_name() == "sqlite":
+        engine = create_async_engine(url, echo=False, future=True)
+        return engine, engine
+
+    if parsed.database in (None, "", ":memory:"):
+        engine = create_async_engine(url, echo=False, future=True)
+        return engine, engine
+
+    write_engine = create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        pool_size=config.DB_WRITE_POOL_SIZE,
+        max_overflow=0,
+    )
+    _install_pragmas(write_engine, readonly=False)
+
+    read_engine = create_async_engine(
+        url,
+        echo=False,
+        future=True,
+        pool_size=config.DB_READ_POOL_SIZE,
+        max_overflow=config.DB_READ_POOL_SIZE,
+    )
+    _install_pragmas(read_engine, readonly=True)
+    return write_engine, read_engine
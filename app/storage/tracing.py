@@ -0,0 +1,170 @@
+"""
+Трассировка SQL (SQL_TRACE=true, по умолчанию выключена).
+
+Слушатели before/after_cursor_execute на движках из app/deps.py замеряют
+каждый запрос (с выборкой строк — aiosqlite читает их сразу), считают
+строки и запоминают функцию репозитория, из которой запрос пришёл: её имя
+кладёт в contextvar обёртка публичных корутин app.storage.repo.
+Статистика копится по нормализованному тексту (литералы и списки
+параметров свёрнуты). Запросы дольше SQL_SLOW_MS пишутся в лог вместе с
+EXPLAIN QUERY PLAN; план снимается один раз на нормализованный запрос.
+Топ самых медленных — на странице админки /sql.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.config import config
+
+log = logging.getLogger("app.sql")
+
+# имя функции app.storage.repo, выполняющейся сейчас (см. instrument_coroutines)
+repo_function: ContextVar[Optional[str]] = ContextVar("repo_function", default=None)
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMS = re.compile(r"\?(?:\s*,\s*\?)+")
+_GROUPS = re.compile(r"(\([^()]*\))(?:\s*,\s*\1)+")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(statement: str) -> str:
+    """Текст запроса без литералов: IN (?, ?, ?) и VALUES (...), (...) сворачиваются."""
+    text = _STRING.sub("?", statement)
+    text = _NUMBER.sub("?", text)
+    text = _PARAMS.sub("?, ...", text)
+    text = _GROUPS.sub(r"\1, ...", text)
+    return _SPACE.sub(" ", text).strip()
+
+
+@dataclass
+class StatementStats:
+    statement: str  # нормализованный текст
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    rows: int = 0
+    slow: int = 0
+    last_at: float = 0.0
+    functions: Counter = field(default_factory=Counter)
+    plan: Optional[List[str]] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "statement": self.statement,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "max_ms": round(self.max * 1000, 3),
+            "rows": self.rows,
+            "mean_rows": round(self.rows / self.count, 1) if self.count else 0.0,
+            "slow": self.slow,
+            "functions": dict(self.functions.most_common(5)),
+            "plan": self.plan,
+        }
+
+
+class SqlTracer:
+
+    def __init__(self, slow_seconds: float, max_statements: int):
+        self.slow_seconds = slow_seconds
+        self.max_statements = max_statements
+        self.stats: Dict[str, StatementStats] = {}
+        self.started_at = time.time()
+
+    def install(self, engine: AsyncEngine):
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._before)
+        event.listen(sync_engine, "after_cursor_execute", self._after)
+
+    def reset(self):
+        self.stats.clear()
+        self.started_at = time.time()
+
+    def top(self, limit: int, sort: str = "total") -> List[dict]:
+        key = {
+            "total": lambda s: s.total,
+            "mean": lambda s: s.total / s.count if s.count else 0.0,
+            "max": lambda s: s.max,
+            "count": lambda s: s.count,
+            "rows": lambda s: s.rows,
+        }.get(sort, lambda s: s.total)
+        return [s.as_dict() for s in sorted(self.stats.values(), key=key, reverse=True)[:limit]]
+
+    # ---------- события движка ----------
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._sql_trace_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_sql_trace_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+
+        rows = cursor.rowcount
+        if rows is None or rows < 0:
+            # SELECT: адаптер aiosqlite уже выбрал строки в cursor._rows (не для stream())
+            fetched = getattr(cursor, "_rows", None)
+            rows = len(fetched) if fetched is not None else 0
+
+        key = normalize(statement)
+        stats = self.stats.get(key)
+        if stats is None:
+            if len(self.stats) >= self.max_statements:
+                # вытесняем самый дешёвый по суммарному времени
+                del self.stats[min(self.stats.values(), key=lambda s: s.total).statement]
+            stats = self.stats[key] = StatementStats(key)
+        stats.count += 1
+        stats.total += elapsed
+        stats.max = max(stats.max, elapsed)
+        stats.rows += rows
+        stats.last_at = time.time()
+        function = repo_function.get() or "-"
+        stats.functions[function] += 1
+
+        if elapsed >= self.slow_seconds:
+            stats.slow += 1
+            if stats.plan is None:
+                stats.plan = self._explain(conn, statement, parameters, executemany)
+            log.warning(
+                "slow query %.1f ms, %s rows, %s: %s\n  plan: %s",
+                elapsed * 1000, rows, function, _SPACE.sub(" ", statement).strip(),
+                "\n        ".join(stats.plan or ["-"]),
+            )
+
+    @staticmethod
+    def _explain(conn, statement: str, parameters, executemany: bool) -> List[str]:
+        if not config.SQL_EXPLAIN or not statement.lstrip().upper().startswith(EXPLAINABLE):
+            return []
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        try:
+            # тем же соединением и в той же транзакции; события SQLAlchemy не срабатывают
+            plan_cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                plan_cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+                return [row[-1] for row in plan_cursor.fetchall()]
+            finally:
+                plan_cursor.close()
+        except Exception as e:
+            return [f"EXPLAIN failed: {type(e).__name__}: {e}"]
+
+
+tracer = SqlTracer(config.SQL_SLOW_MS / 1000, config.SQL_TRACE_MAX_STATEMENTS)
+
+
+def install_tracer(*engines: AsyncEngine):
+    """Подключить трассировку к движкам (один раз на движок)."""
+    for engine in dict.fromkeys(engines):
+        tracer.install(engine)
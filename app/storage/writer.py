@@ -0,0 +1,120 @@
+"""
+Групповая запись входящих сообщений (WRITE_BEHIND=true).
+
+Хендлер бота ставит сообщение в очередь и ждёт future; задача-писатель
+собирает до WRITE_BATCH_MAX сообщений за окно WRITE_BATCH_LATENCY_MS и пишет
+их одной транзакцией (один fsync вместо двух на сообщение), вместе с
+отметками о прочтении, после чего возвращает каждому ожидающему его строку
+с присвоенным id.
+"""
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import config
+from app.deps import SessionLocal
+from app.storage.models import Message
+from app.storage.repo import add_message, mark_admin_messages_read
+
+
+@dataclass
+class WriteResult:
+    message: Message
+    read_ids: List[int] = field(default_factory=list)  # сообщения админа, ставшие 'read'
+
+
+# (поля сообщения, нужно ли отмечать прочтение, future)
+Job = Tuple[Dict[str, Any], bool, asyncio.Future]
+
+
+class MessageWriter:
+
+    def __init__(self, max_batch: int, max_latency: float):
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self.queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дописать очередь и остановить писателя."""
+        if self._task is None:
+            return
+        await self.queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, mark_read: bool = False, **fields) -> WriteResult:
+        """Поставить сообщение в очередь записи и дождаться его сохранения."""
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((fields, mark_read, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            job = await self.queue.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch:
+                try:
+                    job = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        job = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            try:
+                await self._flush(batch)
+            except Exception:
+                # одна плохая строка не должна ронять всю пачку
+                if len(batch) == 1:
+                    continue
+                for single in batch:
+                    try:
+                        await self._flush([single])
+                    except Exception:
+                        pass
+
+    async def _flush(self, batch: List[Job]):
+        try:
+            async with SessionLocal() as session:
+                messages = [await add_message(session, **fields) for fields, _, _ in batch]
+                await session.flush()  # присваивает id
+
+                read_ids: Dict[int, List[int]] = {}
+                for fields, mark_read, _ in batch:
+                    uid = fields["user_id"]
+                    if mark_read and uid not in read_ids:
+                        read_ids[uid] = await mark_admin_messages_read(session, uid)
+
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1 and not batch[0][2].done():
+                batch[0][2].set_exception(e)
+            raise
+
+        for (fields, mark_read, fut), m in zip(batch, messages):
+            # прочитанные id отдаём первому сообщению пользователя в пачке
+            ids = read_ids.pop(fields["user_id"], []) if mark_read else []
+            if not fut.done():
+                fut.set_result(WriteResult(m, ids))
+
+
+message_writer = MessageWriter(config.WRITE_BATCH_MAX, config.WRITE_BATCH_LATENCY_MS / 1000)
@@ -0,0 +1,148 @@
+"""
+Приём апдейтов Telegram через webhook на том же FastAPI-приложении.
+
+Telegram POST-ит апдейт на WEBHOOK_PATH; запрос проверяется по секрету
+(X-Telegram-Bot-Api-Secret-Token), апдейт ставится в обработку и сразу
+получает 200. Хэндлеры aiogram выполняются в фоне через dp.feed_update —
+не больше WEBHOOK_CONCURRENCY одновременно, апдейты одного чата строго
+по очереди. При переполнении (WEBHOOK_MAX_PENDING) отвечаем 503, и Telegram
+повторит доставку сам.
+
+Проверка локально — BOT_MODE=webhook и POST записанного апдейта:
+
+    curl -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -H "Content-Type: application/json" \\
+         -d @update.json http://localhost:8000/telegram/webhook
+"""
+import asyncio
+import hmac
+import logging
+from typing import Dict, List, Optional, Set
+
+from aiogram import Dispatcher
+from aiogram.types import Update
+from fastapi import APIRouter, Request, Response
+
+from app.config import config
+from app.deps import bot
+from app.routers import user
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_dispatcher: Optional[Dispatcher] = None
+
+
+def get_dispatcher() -> Dispatcher:
+    """Общий Dispatcher для polling и webhook (роутер подключается к нему один раз)."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = Dispatcher()
+        _dispatcher.include_router(user.router)
+    return _dispatcher
+
+
+def update_chat_id(update: Update) -> Optional[int]:
+    event = update.message or update.edited_message or update.callback_query
+    if event is None:
+        return None
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    return chat.id if chat else None
+
+
+class WebhookIngest:
+    """Фоновая обработка апдейтов с ограничением параллелизма."""
+
+    def __init__(self):
+        self.pending = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._chat_locks: Dict[int, List] = {}
+
+    def submit(self, update: Update) -> bool:
+        """Поставить апдейт в обработку. False — очередь переполнена."""
+        if self.pending >= config.WEBHOOK_MAX_PENDING:
+            return False
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(config.WEBHOOK_CONCURRENCY)
+        self.pending += 1
+        task = asyncio.create_task(self._handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться уже принятых апдейтов (Telegram считает их доставленными)."""
+        if not self._tasks:
+            return
+        done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning("webhook: %s updates dropped on shutdown", len(pending))
+
+    async def _handle(self, update: Update):
+        chat_id = update_chat_id(update)
+        entry = None
+        if chat_id is not None:
+            # [lock, сколько апдейтов чата ждут/обрабатываются]
+            entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+        try:
+            if entry is None:
+                async with self._slots:
+                    await get_dispatcher().feed_update(bot, update)
+            else:
+                async with entry[0]:
+                    async with self._slots:
+                        await get_dispatcher().feed_update(bot, update)
+        except Exception:
+            logging.exception("webhook: update %s failed", update.update_id)
+        finally:
+            self.pending -= 1
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._chat_locks.pop(chat_id, None)
+
+
+webhook_ingest = WebhookIngest()
+
+router = APIRouter()
+
+
+@router.post(config.WEBHOOK_PATH, include_in_schema=False)
+async def telegram_webhook(request: Request):
+    if config.BOT_MODE != "webhook":
+        return Response(status_code=404)
+
+    secret = request.headers.get(SECRET_HEADER, "")
+    # байты, а не str: compare_digest падает на не-ASCII строках (заголовки — latin-1)
+    if not config.WEBHOOK_SECRET or not hmac.compare_digest(secret.encode(), config.WEBHOOK_SECRET.encode()):
+        return Response(status_code=401)
+
+    try:
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+    except Exception:
+        logging.warning("webhook: malformed update rejected")
+        return Response(status_code=400)
+
+    if not webhook_ingest.submit(update):
+        return Response(status_code=503)
+    return Response(status_code=200)
+
+
+async def setup_webhook():
+    """Зарегистрировать webhook в Telegram (если задан публичный WEBHOOK_URL)."""
+    if not config.WEBHOOK_SECRET:
+        raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_SECRET")
+    if not config.WEBHOOK_URL:
+        logging.info("webhook: WEBHOOK_URL is empty, setWebhook skipped (local mode)")
+        return
+    url = config.WEBHOOK_URL.rstrip("/") + config.WEBHOOK_PATH
+    await bot.set_webhook(
+        url,
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=get_dispatcher().resolve_used_update_types(),
+        max_connections=min(100, max(1, config.WEBHOOK_CONCURRENCY)),
+    )
+    logging.info("webhook registered: %s", url)
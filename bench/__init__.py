@@ -0,0 +1,10 @@
+"""
+Нагрузочные прогоны против локальной заглушки Telegram Bot API.
+
+    python -m bench --help
+
+fake_api  — заглушка Bot API (задержка, 429), направляется через TELEGRAM_API_BASE
+updates   — генератор синтетических апдейтов
+scenarios — ingest, ws, dialog, media
+report    — перцентили, сохранение и сравнение JSON-результатов
+"""
@@ -0,0 +1,172 @@
+"""
+Прогон нагрузочных сценариев против локальной заглушки Bot API.
+
+Поднимает FakeBotAPI, выставляет окружение (своя БД, каталоги и
+TELEGRAM_API_BASE во временном каталоге — рабочие bot.db и media не
+трогаются), запускает приложение в этом же процессе (uvicorn + polling
+или webhook) и по очереди выполняет сценарии. Результат — JSON в
+bench_results/ (или --out).
+
+    python -m bench                                # все сценарии, polling
+    python -m bench --mode webhook --scenarios ingest,ws
+    WRITE_BEHIND=true python -m bench --scenarios ingest --ingest-count 20000
+    python -m bench --compare bench_results/old.json bench_results/new.json
+
+Прочие настройки приложения (WRITE_BEHIND, TG_GLOBAL_RATE, ...) берутся из
+окружения как обычно.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.fake_api import FakeBotAPI
+from bench.report import compare, run_meta, save_results
+from bench.updates import UpdateFactory
+
+BENCH_TOKEN = "123456:BENCH"
+WEBHOOK_SECRET = "bench-secret"
+
+
+def bench_environment(workdir: str, api_base: str, mode: str) -> dict:
+    return {
+        "BOT_TOKEN": BENCH_TOKEN,
+        "DB_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "TELEGRAM_API_BASE": api_base,
+        "BOT_MODE": mode,
+        "WEBHOOK_URL": "",
+        "WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "SESSION_FILE": os.path.join(workdir, "admin_cache.json"),
+        "MEDIA_CACHE_DIR": os.path.join(workdir, "media_cache"),
+        "UPLOAD_DIR": os.path.join(workdir, "media"),
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "ARCHIVE_INTERVAL": "0",
+        "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja_cache"),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def run(args) -> dict:
+    fake = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.retry_after, args.media_size)
+    api_base = await fake.start()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-")
+    os.environ.update(bench_environment(workdir, api_base, args.mode))
+
+    # приложение читает конфиг при импорте — только после окружения
+    import uvicorn
+    from app.main import app, on_startup
+    from app.deps import bot
+    from app.webhook import get_dispatcher
+    from bench import scenarios
+
+    await on_startup()
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            await server_task
+        await asyncio.sleep(0.05)
+
+    dp = get_dispatcher()
+    polling = None
+    if args.mode == "polling":
+        polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+
+    base_url = f"http://127.0.0.1:{port}"
+    results = {}
+    http = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+    try:
+        async with http.get(base_url + "/") as resp:
+            resp.raise_for_status()  # выдаёт cookie admin_token
+        ctx = scenarios.BenchContext(fake, base_url, http, UpdateFactory(args.users), args.mode, args.timeout)
+
+        options = {
+            "ingest": {"count": args.ingest_count, "media_ratio": args.media_ratio},
+            "ws": {"samples": args.ws_samples},
+            "dialog": {"sizes": args.dialog_sizes, "requests": args.dialog_requests},
+            "media": {"files": args.media_files, "size": args.media_size, "concurrency": args.media_concurrency},
+        }
+        for name in args.scenarios:
+            logging.warning("bench: %s ...", name)
+            started = time.perf_counter()
+            fake.reset_stats()
+            try:
+                result = await scenarios.SCENARIOS[name](ctx, **options[name])
+            except Exception as e:
+                logging.exception("bench: scenario %s failed", name)
+                result = {"error": f"{type(e).__name__}: {e}"}
+            result["wall_seconds"] = round(time.perf_counter() - started, 3)
+            result["telegram_calls"] = fake.stats()
+            results[name] = result
+    finally:
+        await http.close()
+        if polling is not None:
+            await dp.stop_polling()
+            await polling
+        server.should_exit = True
+        await server_task
+        await bot.session.close()
+        await fake.stop()
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench")
+    parser.add_argument("--scenarios", default="ingest,ws,dialog,media",
+                        help="через запятую: " + ", ".join(("ingest", "ws", "dialog", "media")))
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--out", help="файл результата (по умолчанию bench_results/<время>-<ревизия>.json)")
+    parser.add_argument("--workdir", help="каталог для БД и файлов прогона (по умолчанию временный)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="ожидание одного шага сценария, секунд")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два сохранённых прогона")
+    # заглушка Bot API
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, секунд")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля вызовов отправки с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    # сценарии
+    parser.add_argument("--users", type=int, default=100, help="синтетических собеседников")
+    parser.add_argument("--ingest-count", type=int, default=5000)
+    parser.add_argument("--media-ratio", type=float, default=0.1, help="доля фото среди входящих")
+    parser.add_argument("--ws-samples", type=int, default=200)
+    parser.add_argument("--dialog-sizes", default="1000,10000,100000")
+    parser.add_argument("--dialog-requests", type=int, default=50)
+    parser.add_argument("--media-files", type=int, default=50)
+    parser.add_argument("--media-size", type=int, default=256 * 1024)
+    parser.add_argument("--media-concurrency", type=int, default=16)
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    args.dialog_sizes = [int(s) for s in args.dialog_sizes.split(",") if s.strip()]
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.compare:
+        print("\n".join(compare(*args.compare)))
+        return
+    unknown = set(args.scenarios) - {"ingest", "ws", "dialog", "media"}
+    if unknown:
+        sys.exit(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    options = {k: v for k, v in vars(args).items() if k not in ("compare", "out", "workdir")}
+    meta = run_meta(options)
+    results = asyncio.run(run(args))
+    path = save_results({"meta": meta, "results": results}, args.out)
+    print(f"results: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Заглушка Telegram Bot API для нагрузочных прогонов.
+
+Отвечает на то, что вызывают бот и админка: getMe, getUpdates (long polling
+из очереди синтетических апдейтов), sendMessage / sendPhoto / sendVideo /
+sendDocument / sendVoice / sendAudio, getFile, скачивание файла по
+/file/bot<token>/<path> (с Range), deleteMessage(s), setWebhook /
+deleteWebhook. Каждый вызов задерживается на latency (± jitter) секунд,
+а доля flood_rate вызовов отправки получает 429 с retry_after — как при
+превышении лимитов настоящим ботом.
+
+Приложение направляется сюда через TELEGRAM_API_BASE. Отдельно:
+
+    python -m bench.fake_api --port 8081 --latency 0.05 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 1000001, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# методы отправки: поле ответа, в котором лежит файл
+MEDIA_METHODS = {
+    "sendPhoto": "photo",
+    "sendVideo": "video",
+    "sendDocument": "document",
+    "sendVoice": "voice",
+    "sendAudio": "audio",
+}
+FLOOD_METHODS = {"sendMessage", "deleteMessage", "deleteMessages", *MEDIA_METHODS}
+
+# потолок ожидания getUpdates: бот всё равно переспросит, а остановка не ждёт
+MAX_POLL_WAIT = 1.0
+
+
+class FakeBotAPI:
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        flood_rate: float = 0.0,
+        retry_after: int = 1,
+        file_size: int = 256 * 1024,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.file_size = file_size
+        self.calls: Counter = Counter()
+        self.floods: Counter = Counter()
+        self.bytes_served = 0
+        self._random = random.Random(seed)
+        self._updates: Deque[dict] = deque()
+        self._next_update_id = 1
+        self._has_updates = asyncio.Event()
+        self._message_id = 0
+        self._file_seq = 0
+        self._files: Dict[str, int] = {}  # file_id -> размер
+        self._blob = b""
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    # ---------- управление ----------
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self._method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def push_updates(self, updates: List[dict]):
+        """Поставить апдейты в очередь getUpdates (update_id назначается здесь)."""
+        for update in updates:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+        if updates:
+            self._has_updates.set()
+
+    def add_file(self, file_id: str, size: Optional[int] = None):
+        """Файл, который отдадут getFile и /file/... (иначе — размер по умолчанию)."""
+        self._files[file_id] = size if size is not None else self.file_size
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "floods": dict(self.floods),
+            "bytes_served": self.bytes_served,
+            "pending_updates": len(self._updates),
+        }
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.floods.clear()
+        self.bytes_served = 0
+
+    # ---------- HTTP ----------
+
+    async def _delay(self):
+        delay = self.latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        # загруженные файлы остаются FileField — содержимое не нужно, только факт
+        params = dict(await request.post())
+        params.update(request.query)
+        return params
+
+    async def _method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return self._ok(await self._get_updates(params))
+
+        await self._delay()
+        if method in FLOOD_METHODS and self.flood_rate and self._random.random() < self.flood_rate:
+            self.floods[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        handler = getattr(self, f"_m_{method}", None)
+        if handler is None and method in MEDIA_METHODS:
+            return self._ok(self._send_media(method, params))
+        if handler is None:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found: method not found"},
+                status=404,
+            )
+        return handler(params)
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()  # подтверждены offset-ом
+        if not self._updates and timeout > 0:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), min(timeout, MAX_POLL_WAIT))
+            except asyncio.TimeoutError:
+                pass
+        return [u for _, u in zip(range(limit), self._updates)]
+
+    def _message(self, params: dict, **fields) -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+
+    def _new_file(self, kind: str) -> str:
+        self._file_seq += 1
+        file_id = f"bench-{kind}-{self._file_seq}"
+        self.add_file(file_id)
+        return file_id
+
+    def _m_getMe(self, params: dict) -> web.Response:
+        return self._ok(BOT_USER)
+
+    def _m_sendMessage(self, params: dict) -> web.Response:
+        return self._ok(self._message(params, text=params.get("text", "")))
+
+    def _send_media(self, method: str, params: dict) -> dict:
+        kind = MEDIA_METHODS[method]
+        media = params.get(kind)
+        if isinstance(media, str) and not media.startswith("attach://"):
+            file_id = media  # повторная отправка по file_id
+        else:
+            file_id = self._new_file(kind)
+        obj = {"file_id": file_id, "file_unique_id": file_id, "file_size": self._files.get(file_id, self.file_size)}
+        if kind == "photo":
+            obj = [{**obj, "width": 1280, "height": 720}]
+        elif kind in ("video", "voice", "audio"):
+            obj["duration"] = 1
+        if kind == "video":
+            obj.update(width=1280, height=720)
+        fields = {kind: obj}
+        if params.get("caption"):
+            fields["caption"] = params["caption"]
+        return self._message(params, **fields)
+
+    def _m_getFile(self, params: dict) -> web.Response:
+        file_id = params.get("file_id", "")
+        size = self._files.setdefault(file_id, self.file_size)
+        return self._ok({
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": size,
+            "file_path": f"files/{file_id}",
+        })
+
+    def _m_deleteMessage(self, params: dict) -> web.Response:
+        return self._ok(True)
+
+    def _m_deleteMessages(self, params: dict) -> web.Response:
+        return self._ok(True)
+
+    def _m_setWebhook(self, params: dict) -> web.Response:
+        return self._ok(True)
+
+    def _m_deleteWebhook(self, params: dict) -> web.Response:
+        return self._ok(True)
+
+    def _m_sendChatAction(self, params: dict) -> web.Response:
+        return self._ok(True)
+
+    async def _download(self, request: web.Request) -> web.StreamResponse:
+        self.calls["download"] += 1
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        size = self._files.get(file_id)
+        if size is None:
+            return web.Response(status=404)
+        await self._delay()
+
+        if len(self._blob) < size:
+            self._blob = bytes(self._random.getrandbits(8) for _ in range(min(size, 1024))) * (size // 1024 + 1)
+        start, end, status = 0, size - 1, 200
+        headers = {"Content-Type": "application/octet-stream"}
+        range_header = request.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            if start > end:
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        body = self._blob[start:end + 1]
+        self.bytes_served += len(body)
+        return web.Response(body=body, status=status, headers=headers)
+
+
+async def serve(args):
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.retry_after, args.file_size)
+    url = await api.start(args.host, args.port)
+    print(f"fake Bot API: TELEGRAM_API_BASE={url}")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            print(json.dumps(api.stats()))
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m bench.fake_api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа, секунд")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля вызовов отправки с ответом 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--file-size", type=int, default=256 * 1024)
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
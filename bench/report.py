@@ -0,0 +1,96 @@
+"""
+Сводка и сохранение результатов: перцентили задержек, JSON-файл прогона
+и сравнение двух прогонов (например, до и после изменения).
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+
+def percentile(values: List[float], q: float) -> float:
+    """q-й перцентиль (0..100) по отсортированному списку, с интерполяцией."""
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def latency_summary(seconds: Iterable[float]) -> dict:
+    """Задержки в секундах → count / mean / p50 / p90 / p99 / max в миллисекундах."""
+    ms = sorted(s * 1000 for s in seconds)
+    if not ms:
+        return {"count": 0}
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3),
+        "p50_ms": round(percentile(ms, 50), 3),
+        "p90_ms": round(percentile(ms, 90), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(ms[-1], 3),
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return out.stdout.strip() or None
+
+
+def run_meta(options: dict) -> dict:
+    return {
+        "started_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "options": options,
+    }
+
+
+def save_results(results: dict, path: Optional[str] = None) -> str:
+    if path is None:
+        stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        revision = (results.get("meta") or {}).get("revision") or "unknown"
+        path = os.path.join("bench_results", f"{stamp}-{revision}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def _flatten(data, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            flat.update(_flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        flat[prefix] = float(data)
+    return flat
+
+
+def compare(old_path: str, new_path: str) -> List[str]:
+    """Построчное сравнение числовых метрик двух прогонов."""
+    with open(old_path, encoding="utf-8") as f:
+        old = _flatten(json.load(f).get("results", {}))
+    with open(new_path, encoding="utf-8") as f:
+        new = _flatten(json.load(f).get("results", {}))
+
+    lines = []
+    for key in sorted(old.keys() | new.keys()):
+        a, b = old.get(key), new.get(key)
+        if a is None or b is None:
+            lines.append(f"{key:60} {a if a is not None else '-':>12} {b if b is not None else '-':>12}")
+            continue
+        delta = f"{(b - a) / a * 100:+.1f}%" if a else ""
+        lines.append(f"{key:60} {a:>12.3f} {b:>12.3f} {delta:>9}")
+    return lines
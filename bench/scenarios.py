@@ -0,0 +1,326 @@
+"""
+Сценарии нагрузки. Каждый получает BenchContext (заглушка Bot API, адрес
+поднятого приложения, HTTP-клиент с cookie админки) и возвращает словарь
+метрик для JSON-отчёта.
+
+Модуль импортирует app.* — окружение (DB_URL, TELEGRAM_API_BASE и т. д.)
+должно быть выставлено до импорта, это делает bench.__main__.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, List, Tuple
+from uuid import uuid4
+
+import aiohttp
+from sqlalchemy import func, insert, select
+
+from app.config import config
+from app.deps import SessionLocal, ReadSessionLocal
+from app.storage.models import Message
+from app.storage.repo import rebuild_conversations
+from bench.fake_api import FakeBotAPI
+from bench.report import latency_summary
+from bench.updates import UpdateFactory
+
+WEBHOOK_CONCURRENCY = 64
+SEED_CHUNK = 5000
+# пользователи для замера страницы диалога: 900000000 + размер диалога
+DIALOG_USER_BASE = 900000000
+
+
+@dataclass
+class BenchContext:
+    fake: FakeBotAPI
+    base_url: str
+    http: aiohttp.ClientSession
+    factory: UpdateFactory
+    mode: str = "polling"
+    timeout: float = 120.0
+
+
+# =========================
+#   ДОСТАВКА АПДЕЙТОВ
+# =========================
+
+async def deliver(ctx: BenchContext, updates: List[dict]):
+    """Отдать апдейты боту: в очередь getUpdates или POST-ом на webhook."""
+    if ctx.mode == "polling":
+        ctx.fake.push_updates(updates)
+        return
+
+    url = ctx.base_url + config.WEBHOOK_PATH
+    headers = {"X-Telegram-Bot-Api-Secret-Token": config.WEBHOOK_SECRET}
+    slots = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+
+    async def post(update: dict):
+        async with slots:
+            while True:
+                async with ctx.http.post(url, json=update, headers=headers) as resp:
+                    if resp.status != 503:
+                        resp.raise_for_status()
+                        return
+                await asyncio.sleep(0.05)  # очередь полна — повторяем, как Telegram
+
+    await asyncio.gather(*(post(u) for u in updates))
+
+
+async def max_message_id() -> int:
+    async with ReadSessionLocal() as session:
+        return (await session.execute(select(func.max(Message.id)))).scalar() or 0
+
+
+async def wait_for_messages(after_id: int, count: int, timeout: float) -> int:
+    """Ждать, пока в messages появится count строк с id > after_id. Возвращает сколько появилось."""
+    deadline = time.perf_counter() + timeout
+    stored = 0
+    while time.perf_counter() < deadline:
+        async with ReadSessionLocal() as session:
+            stored = (await session.execute(
+                select(func.count(Message.id)).where(Message.id > after_id)
+            )).scalar() or 0
+        if stored >= count:
+            break
+        await asyncio.sleep(0.02)
+    return stored
+
+
+# =========================
+#   СЦЕНАРИИ
+# =========================
+
+async def ingest(ctx: BenchContext, count: int = 5000, media_ratio: float = 0.1) -> dict:
+    """Входящие сообщения в секунду: от выдачи апдейтов до записи в БД."""
+    baseline = await max_message_id()
+    updates = ctx.factory.batch(count, media_ratio)
+
+    started = time.perf_counter()
+    await deliver(ctx, updates)
+    accepted = time.perf_counter() - started
+    stored = await wait_for_messages(baseline, count, ctx.timeout)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "mode": ctx.mode,
+        "write_behind": config.WRITE_BEHIND,
+        "updates": count,
+        "stored": stored,
+        "seconds": round(elapsed, 3),
+        "accepted_seconds": round(accepted, 3),
+        "msgs_per_s": round(stored / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+class FrameWaiter:
+    """Читает кадры сокета диалога и будит тех, кто ждёт нужный кадр."""
+
+    def __init__(self, ws: aiohttp.ClientWebSocketResponse, keep: int = 1000):
+        self.ws = ws
+        self._recent: Deque[Tuple[float, dict]] = deque(maxlen=keep)
+        self._waiters: List[tuple] = []  # (predicate, future)
+        self._task = asyncio.create_task(self._read())
+
+    def expect(self, predicate) -> asyncio.Future:
+        """
+        Future с (момент получения, кадр) для первого кадра, где predicate истинен;
+        кадр мог прийти и чуть раньше вызова — недавние кадры тоже просматриваются.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        for at, item in self._recent:
+            if predicate(item):
+                fut.set_result((at, item))
+                return fut
+        self._waiters.append((predicate, fut))
+        return fut
+
+    async def _read(self):
+        async for msg in self.ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                continue
+            frame = json.loads(msg.data)
+            frames = frame.get("changes") if frame.get("action") == "resync" else [frame]
+            now = time.perf_counter()
+            for item in frames or ():
+                self._recent.append((now, item))
+                for waiter in list(self._waiters):
+                    predicate, fut = waiter
+                    if not fut.done() and predicate(item):
+                        fut.set_result((now, item))
+                        self._waiters.remove(waiter)
+
+    async def close(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def ws_latency(ctx: BenchContext, samples: int = 200) -> dict:
+    """
+    Задержки доставки в сокет диалога:
+    incoming — апдейт выдан боту → кадр message у админа;
+    echo — админ отправил send → его сообщение вернулось кадром;
+    delivered — send → статус delivered (через outbox и заглушку sendMessage;
+    сюда входит и лимит на чат TG_CHAT_RATE — сообщения идут в один диалог).
+    """
+    user_id = ctx.factory.user_ids[0]
+    ws_url = ctx.base_url.replace("http", "ws", 1) + f"/ws/{user_id}"
+    incoming: List[float] = []
+    echo: List[float] = []
+    delivered: List[float] = []
+    lost = 0
+
+    async with ctx.http.ws_connect(ws_url) as ws:
+        frames = FrameWaiter(ws)
+        try:
+            for i in range(samples):
+                marker = f"in-{i}-{uuid4().hex[:8]}"
+                got = frames.expect(lambda f, m=marker: f.get("action") == "message" and f.get("text") == m)
+                started = time.perf_counter()
+                await deliver(ctx, [ctx.factory.message(user_id, text=marker)])
+                try:
+                    at, _ = await asyncio.wait_for(got, ctx.timeout)
+                except asyncio.TimeoutError:
+                    lost += 1
+                    continue
+                incoming.append(at - started)
+
+            for i in range(samples):
+                marker = f"out-{i}-{uuid4().hex[:8]}"
+                got = frames.expect(lambda f, m=marker: f.get("action") == "message" and f.get("text") == m)
+                started = time.perf_counter()
+                await ws.send_json({"action": "send", "text": marker})
+                try:
+                    at, frame = await asyncio.wait_for(got, ctx.timeout)
+                except asyncio.TimeoutError:
+                    lost += 1
+                    continue
+                echo.append(at - started)
+                done = frames.expect(lambda f, mid=frame["id"]: _delivered(f, mid))
+                try:
+                    at, _ = await asyncio.wait_for(done, ctx.timeout)
+                except asyncio.TimeoutError:
+                    lost += 1
+                    continue
+                delivered.append(at - started)
+        finally:
+            await frames.close()
+
+    return {
+        "mode": ctx.mode,
+        "incoming": latency_summary(incoming),
+        "echo": latency_summary(echo),
+        "delivered": latency_summary(delivered),
+        "lost": lost,
+    }
+
+
+def _delivered(frame: dict, msg_id: int) -> bool:
+    if frame.get("action") == "status_batch":
+        return msg_id in (frame.get("statuses") or {}).get("delivered", ())
+    if frame.get("action") == "status_update":
+        return frame.get("id") == msg_id and frame.get("status") == "delivered"
+    return False
+
+
+async def seed_dialog(user_id: int, count: int):
+    """Диалог из count сообщений: по одному в секунду, попеременно от собеседника и админа."""
+    start = datetime.utcnow() - timedelta(seconds=count)
+    async with SessionLocal() as session:
+        for offset in range(0, count, SEED_CHUNK):
+            rows = [
+                {
+                    "user_id": user_id,
+                    "username": config.ADMIN_NAME if i % 2 else f"bench{user_id}",
+                    "text": f"сообщение {i} " + "текст " * (i % 20),
+                    "tg_message_id": i + 1,
+                    "created_at": start + timedelta(seconds=i),
+                    "status": "read",
+                }
+                for i in range(offset, min(count, offset + SEED_CHUNK))
+            ]
+            await session.execute(insert(Message), rows)
+        await session.commit()
+
+
+async def dialog_page(ctx: BenchContext, sizes=(1000, 10000, 100000), requests: int = 50) -> dict:
+    """Время до первого байта и полное время страницы /dialog/{id} при разной длине диалога."""
+    seeded = {}
+    for size in sizes:
+        started = time.perf_counter()
+        await seed_dialog(DIALOG_USER_BASE + size, size)
+        seeded[size] = round(time.perf_counter() - started, 3)
+    async with SessionLocal() as session:
+        await rebuild_conversations(session)
+
+    results = {}
+    for size in sizes:
+        url = f"{ctx.base_url}/dialog/{DIALOG_USER_BASE + size}"
+        ttfb: List[float] = []
+        total: List[float] = []
+        body_bytes = 0
+        for i in range(requests + 3):
+            started = time.perf_counter()
+            async with ctx.http.get(url) as resp:
+                resp.raise_for_status()
+                first = await resp.content.readany()
+                first_at = time.perf_counter()
+                rest = await resp.read()
+                done_at = time.perf_counter()
+            if i < 3:
+                continue  # прогрев
+            ttfb.append(first_at - started)
+            total.append(done_at - started)
+            body_bytes = len(first) + len(rest)
+        results[str(size)] = {
+            "seed_seconds": seeded[size],
+            "ttfb": latency_summary(ttfb),
+            "total": latency_summary(total),
+            "page_bytes": body_bytes,
+        }
+    return results
+
+
+async def media_proxy(ctx: BenchContext, files: int = 50, size: int = 256 * 1024, concurrency: int = 16) -> dict:
+    """Пропускная способность /media_proxy: первый проход — из заглушки, второй — из локального кэша."""
+    file_ids = [f"bench-media-{uuid4().hex[:8]}-{i}" for i in range(files)]
+    for file_id in file_ids:
+        ctx.fake.add_file(file_id, size)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def fetch(file_id: str) -> int:
+        async with slots:
+            async with ctx.http.get(f"{ctx.base_url}/media_proxy/{file_id}") as resp:
+                resp.raise_for_status()
+                received = 0
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    received += len(chunk)
+                return received
+
+    results = {}
+    for name in ("cold", "warm"):
+        downloads_before = ctx.fake.calls["download"]
+        started = time.perf_counter()
+        sizes = await asyncio.gather(*(fetch(f) for f in file_ids))
+        elapsed = time.perf_counter() - started
+        total = sum(sizes)
+        results[name] = {
+            "requests": len(file_ids),
+            "bytes": total,
+            "seconds": round(elapsed, 3),
+            "mb_per_s": round(total / elapsed / 1024 / 1024, 2) if elapsed else 0.0,
+            "req_per_s": round(len(file_ids) / elapsed, 1) if elapsed else 0.0,
+            "upstream_downloads": ctx.fake.calls["download"] - downloads_before,
+        }
+    results["file_size"] = size
+    results["concurrency"] = concurrency
+    return results
+
+
+SCENARIOS = {
+    "ingest": ingest,
+    "ws": ws_latency,
+    "dialog": dialog_page,
+    "media": media_proxy,
+}
@@ -0,0 +1,45 @@
+"""
+Синтетические апдейты Telegram: личные сообщения от набора пользователей,
+текст и (по доле media_ratio) фото. update_id назначает получатель —
+FakeBotAPI.push_updates или отправка на webhook.
+"""
+import itertools
+import random
+import time
+from typing import List, Optional
+
+FIRST_USER_ID = 500000000
+
+
+class UpdateFactory:
+
+    def __init__(self, users: int = 100, first_user_id: int = FIRST_USER_ID, seed: int = 0):
+        self.user_ids = list(range(first_user_id, first_user_id + users))
+        self._random = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+    @staticmethod
+    def username(user_id: int) -> str:
+        return f"bench{user_id}"
+
+    def message(self, user_id: Optional[int] = None, text: Optional[str] = None, photo: bool = False) -> dict:
+        user_id = user_id or self._random.choice(self.user_ids)
+        message_id = next(self._message_ids)
+        user = {"id": user_id, "is_bot": False, "first_name": "Bench", "username": self.username(user_id)}
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "username": user["username"], "first_name": "Bench"},
+            "from": user,
+        }
+        if photo:
+            file_id = f"bench-in-photo-{message_id}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720, "file_size": 1}]
+            message["caption"] = text or ""
+        else:
+            message["text"] = text if text is not None else f"сообщение {message_id}"
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def batch(self, count: int, media_ratio: float = 0.0) -> List[dict]:
+        return [self.message(photo=self._random.random() < media_ratio) for _ in range(count)]
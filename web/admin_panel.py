@@ -1,172 +1,439 @@
-from fastapi import APIRouter, Request, WebSocket, UploadFile, File, Form, WebSocketDisconnect
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, UploadFile, File, Form, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
-from jinja2 import Environment, FileSystemLoader
-from app.storage.repo import get_all_users, save_message, get_user_messages, update_message_status, get_message_by_id
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+from app.storage.repo import (
+    save_message, update_message_status, get_message_by_id,
+    get_user_messages_page, stream_latest_messages, get_dialog_username, encode_cursor, decode_cursor,
+    get_conversations, mark_conversation_read, mark_messages_deleted, get_deletable_messages,
+    get_media_file_id, remember_media_file, forget_media_file,
+    create_campaign, get_campaign, get_campaigns, set_campaign_status,
+    search_messages, encode_search_cursor, decode_search_cursor, MARK_START, MARK_END,
+)
+from app.services.cleanup import delete_user_history
+from app.changes import changes_since, current_seq
+from app.services.campaigns import campaign_runner
+from app.services.outbox import outbox
+from app.services.uploads import (
+    SEND_METHODS, UploadInputFile, detect_media_type, sent_file_id, remove_file, hash_upload, stage_to_disk,
+)
 from app.config import config
 from app import config as app_config
-from app.auth import create_token, verify_token
-import json, os, asyncio, aiohttp, mimetypes
-from typing import List
+from app.sessions import sessions
+from app.metrics import MEDIA_REQUESTS, MEDIA_BYTES, UPLOAD_BYTES
+from app.storage.tracing import tracer
+import json, os, asyncio, aiohttp, aiofiles, hashlib, html
+from typing import List, Optional, Tuple
 from uuid import uuid4
-from app.deps import SessionLocal, bot
-from app.notifications import register_ws, unregister_ws, send_to_user_ws
-from datetime import datetime
-from aiogram.types import FSInputFile, InputMediaPhoto, InputMediaVideo
+from app.deps import SessionLocal, ReadSessionLocal, bot, get_http
+from app.services.media_cache import media_cache, resolve_file, telegram_file_url, guess_media_type
+from app.notifications import register_ws, register_feed, unregister_ws, send_to_user_ws, queue_status, queue_statuses
+from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InputMediaPhoto, InputMediaVideo
+
+
+
+def template_env() -> Environment:
+    bytecode_cache = None
+    if config.TEMPLATE_CACHE_DIR:
+        os.makedirs(config.TEMPLATE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(config.TEMPLATE_CACHE_DIR)
+    return Environment(
+        loader=FileSystemLoader("web/templates"),
+        auto_reload=config.TEMPLATE_AUTO_RELOAD,
+        bytecode_cache=bytecode_cache,
+        # текст сообщений и имена приходят от пользователей Telegram
+        autoescape=select_autoescape(["html"]),
+        enable_async=True,
+    )
+
 
-env = Environment(loader=FileSystemLoader("web/templates"))
+env = template_env()
 router = APIRouter()
 
-CACHE_FILE = "web/.admin_cache.json"
 
+def precompile_templates() -> int:
+    """Скомпилировать все шаблоны при старте, чтобы первые запросы не ждали компиляции."""
+    names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
 
-def read_cache():
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+# ------------------ Auth ------------------
 
+class AdminAuthRequired(Exception):
+    """Запрос без действующей сессии: страницы уводят на "/", API отвечает 401."""
 
-def write_cache(d):
-    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(d, f)
+    def __init__(self, page: bool):
+        self.page = page
 
 
-def is_authed(request: Request):
-    token = request.cookies.get("admin_token")
-    if token and verify_token(token):
-        return True
-    cache = read_cache()
-    token = cache.get("token")
-    if token and verify_token(token):
-        return True
-    return False
+async def auth_required_handler(request: Request, exc: AdminAuthRequired):
+    if exc.page:
+        return RedirectResponse("/", status_code=302)
+    return JSONResponse({"ok": False, "error": "unauthorized"}, status_code=401)
+
+
+def is_authed(request) -> bool:
+    """Работает и для Request, и для WebSocket: проверка — поиск в памяти."""
+    return sessions.is_authed(request.cookies.get("admin_token"))
+
+
+async def admin_page(request: Request):
+    if not is_authed(request):
+        raise AdminAuthRequired(page=True)
+
+
+async def admin_api(request: Request):
+    if not is_authed(request):
+        raise AdminAuthRequired(page=False)
 
 
 # ------------------ Media proxy (Telegram) ------------------
 
-from fastapi.responses import Response, HTMLResponse
-import aiohttp
+def media_etag(file_id: str) -> str:
+    """ETag по file_id: содержимое файла в Telegram под одним file_id не меняется."""
+    return '"' + hashlib.sha1(file_id.encode()).hexdigest() + '"'
 
-@router.get("/media_proxy/{file_id:path}")
-async def media_proxy(file_id: str):
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбор заголовка Range для одного диапазона: (start, end) включительно.
+    None — отдать файл целиком, ValueError — диапазон вне файла (416).
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_s, _, end_s = range_header[len("bytes="):].strip().partition("-")
     try:
-        # --- 1) Определяем file_path ---
-        if "/" in file_id:
-            # старые записи содержат готовый file_path
-            file_path = file_id
+        if start_s:
+            start = int(start_s)
+            end = int(end_s) if end_s else size - 1
         else:
-            # новый формат — это Telegram FILE_ID
-            tg_file = await bot.get_file(file_id)
-            file_path = tg_file.file_path
-
-        url = f"https://api.telegram.org/file/bot{config.BOT_TOKEN}/{file_path}"
+            # bytes=-N — последние N байт
+            start = max(size - int(end_s), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError(range_header)
+    return start, end
+
+
+async def stream_upstream(resp: aiohttp.ClientResponse):
+    """Отдаёт тело ответа Telegram по кускам, не держа файл целиком в памяти."""
+    try:
+        async for chunk in resp.content.iter_chunked(config.MEDIA_CHUNK_SIZE):
+            MEDIA_BYTES.inc("upstream", amount=len(chunk))
+            yield chunk
+    finally:
+        resp.release()
+
+
+async def stream_file(path: str, start: int, length: int):
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        while length > 0:
+            chunk = await f.read(min(config.MEDIA_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            MEDIA_BYTES.inc("cache", amount=len(chunk))
+            yield chunk
+
+
+def cached_file_response(request: Request, path: str, headers: dict):
+    size = os.stat(path).st_size
+    headers = dict(headers)
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    status_code = 200
+    start, end = 0, size - 1
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(
+        stream_file(path, start, end - start + 1),
+        status_code=status_code,
+        media_type=guess_media_type(path),
+        headers=headers,
+    )
 
-        # --- 2) Качаем файл полностью ---
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    return HTMLResponse("File not found", status_code=404)
 
-                data = await resp.read()
+@router.get("/media_proxy/{file_id:path}", dependencies=[Depends(admin_api)])
+async def media_proxy(request: Request, file_id: str):
+    etag = media_etag(file_id)
+    base_headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=86400",
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        MEDIA_REQUESTS.inc("not_modified")
+        return Response(status_code=304, headers=base_headers)
 
-                return Response(
-                    content=data,
-                    media_type=resp.headers.get("Content-Type", "application/octet-stream"),
-                )
+    try:
+        # --- 1) Локальный кэш ---
+        path = await media_cache.lookup(file_id)
+        if path:
+            try:
+                response = cached_file_response(request, path, base_headers)
+                MEDIA_REQUESTS.inc("hit")
+                return response
+            except FileNotFoundError:
+                path = None  # вытеснен между lookup и отдачей
+
+        # --- 2) Определяем file_path (get_file кэшируется по TTL) ---
+        file_path, file_size = await resolve_file(file_id)
+
+        # --- 3) Небольшие файлы качаем в кэш один раз на всех зрителей ---
+        if media_cache.cacheable(file_size):
+            MEDIA_REQUESTS.inc("miss")
+            try:
+                path = await media_cache.fetch(file_id, file_path)
+            except FileNotFoundError:
+                return HTMLResponse("File not found", status_code=404)
+            return cached_file_response(request, path, base_headers)
+
+        # --- 4) Остальное проксируем потоком (Range пробрасываем как есть) ---
+        upstream_headers = {}
+        range_header = request.headers.get("range")
+        if range_header:
+            upstream_headers["Range"] = range_header
+
+        resp = await get_http().get(telegram_file_url(file_path), headers=upstream_headers)
+        if resp.status == 416:
+            resp.release()
+            return Response(
+                status_code=416,
+                headers={"Content-Range": resp.headers.get("Content-Range", "bytes */*")},
+            )
+        if resp.status not in (200, 206):
+            resp.release()
+            return HTMLResponse("File not found", status_code=404)
+
+        MEDIA_REQUESTS.inc("stream")
+        headers = dict(base_headers)
+        for name in ("Content-Length", "Content-Range"):
+            if name in resp.headers:
+                headers[name] = resp.headers[name]
+
+        return StreamingResponse(
+            stream_upstream(resp),
+            status_code=resp.status,
+            media_type=resp.headers.get("Content-Type", "application/octet-stream"),
+            headers=headers,
+        )
 
     except Exception as e:
+        MEDIA_REQUESTS.inc("error")
         print("[media_proxy ERROR]:", e)
         return HTMLResponse("Error fetching media", status_code=500)
 
 # ------------------ Pages ------------------
 
 @router.get("/", response_class=HTMLResponse)
-async def index(request: Request):
+async def index(request: Request, before: Optional[str] = None):
     token = request.cookies.get("admin_token")
-    cache = read_cache()
-    if not token and cache.get("token") and verify_token(cache.get("token")):
-        token = cache.get("token")
-    if not token or not verify_token(token):
-        token = create_token()
-        cache["token"] = token
-        write_cache(cache)
+    if not sessions.verify(token):
+        token = sessions.shared_token() or sessions.issue_shared()
 
-    async with SessionLocal() as session:
-        users = await get_all_users(session)
-        users = [u for u in users if (u[1] or "").lower() != (config.ADMIN_NAME or "admin").lower()]
+    async with ReadSessionLocal() as session:
+        rows = await get_conversations(session, decode_cursor(before), config.INDEX_PAGE_SIZE + 1)
+
+    next_cursor = None
+    if len(rows) > config.INDEX_PAGE_SIZE:
+        rows = rows[:config.INDEX_PAGE_SIZE]
+        next_cursor = encode_cursor(rows[-1].last_activity, rows[-1].user_id)
 
     tpl = env.get_template("index.html")
-    resp = HTMLResponse(tpl.render(users=[(u[0], u[1]) for u in users]))
+    resp = HTMLResponse(await tpl.render_async(conversations=rows, next_cursor=next_cursor))
     resp.set_cookie("admin_token", token, httponly=True, max_age=60 * 60 * 8)
     return resp
 
 
-@router.get("/dialog/{user_id}", response_class=HTMLResponse)
-async def dialog(request: Request, user_id: int):
-    if not is_authed(request):
-        return RedirectResponse("/", status_code=302)
-
-    async with SessionLocal() as session:
-        messages = await get_user_messages(session, user_id)
-
+def message_to_dict(m) -> dict:
+    return {
+        "id": m.id,
+        "username": m.username,
+        "text": m.text,
+        "created_at": (
+            m.created_at.isoformat() if hasattr(m.created_at, "isoformat") else str(m.created_at)
+        ),
+        "status": getattr(m, "status", "sent"),
+        "file_id": getattr(m, "file_id", None),
+        "media_type": getattr(m, "media_type", None),
+    }
+
+
+async def load_history_page(session, user_id: int, before: Optional[str], limit: int):
+    """
+    Страница истории (в хронологическом порядке) и курсор следующей, более старой.
+    """
+    rows = await get_user_messages_page(session, user_id, decode_cursor(before), limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [message_to_dict(m) for m in reversed(rows)], next_cursor
+
+
+async def render_dialog(user_id: int):
+    """
+    Страница диалога по частям: первая страница истории идёт в шаблон прямо из
+    курсора БД, так что ни время до первого байта, ни память не растут с размером диалога.
+    """
     tpl = env.get_template("dialog.html")
-    msgs = []
-    for m in messages:
-        msgs.append(
-            {
-                "id": m.id,
-                "username": m.username,
-                "text": m.text,
-                "created_at": (
-                    m.created_at.isoformat() if hasattr(m.created_at, "isoformat") else str(m.created_at)
-                ),
-                "status": getattr(m, "status", "sent"),
-                "file_id": getattr(m, "file_id", None),
-                "media_type": getattr(m, "media_type", None),
-            }
-        )
-
-    username = None
-    for m in messages:
-        if m.username and m.username != config.ADMIN_NAME:
-            username = m.username
-            break
+    async with ReadSessionLocal() as session:
+        # seq до чтения истории: всё, что случится после, клиент докачает через resume
+        seq = await current_seq(session)
+        username = await get_dialog_username(session, user_id, config.ADMIN_NAME)
+        page = await stream_latest_messages(session, user_id, config.DIALOG_PAGE_SIZE)
+        if page is None:
+            # есть архив — страницу собирает обычная выборка с чтением сегментов
+            msgs, next_cursor = await load_history_page(session, user_id, None, config.DIALOG_PAGE_SIZE)
+        else:
+            result, cursor = page
+            msgs = (message_to_dict(row) async for row in result)
+            next_cursor = encode_cursor(*cursor) if cursor else None
 
-    return HTMLResponse(
-        tpl.render(
+        async for chunk in tpl.generate_async(
             user_id=user_id,
             username=username,
             messages=msgs,
+            next_cursor=next_cursor,
+            seq=seq,
             config=app_config,
-        )
-    )
+        ):
+            yield chunk
+
+
+@router.get("/dialog/{user_id}", response_class=HTMLResponse, dependencies=[Depends(admin_page)])
+async def dialog(user_id: int):
+    async with SessionLocal() as session:
+        await mark_conversation_read(session, user_id)
+
+    return StreamingResponse(render_dialog(user_id), media_type="text/html; charset=utf-8")
+
+
+@router.get("/api/dialog/{user_id}/history", dependencies=[Depends(admin_api)])
+async def dialog_history(user_id: int, before: Optional[str] = None, limit: Optional[int] = None):
+    limit = max(1, min(limit or config.DIALOG_PAGE_SIZE, config.HISTORY_MAX_PAGE))
+    async with ReadSessionLocal() as session:
+        msgs, next_cursor = await load_history_page(session, user_id, before, limit)
+
+    return JSONResponse({"ok": True, "messages": msgs, "next_cursor": next_cursor})
+
+
+# ------------------ Search ------------------
+
+def parse_day(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def snippet_html(snippet: Optional[str]) -> str:
+    """Экранировать текст сообщения и превратить маркеры FTS5 в <mark>."""
+    escaped = html.escape(snippet or "")
+    return escaped.replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+@router.get("/api/search", dependencies=[Depends(admin_api)])
+async def search(
+    q: str = "",
+    user_id: Optional[int] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    media_type: Optional[str] = None,
+    status: Optional[str] = None,
+    sort: str = "rank",
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+):
+    limit = max(1, min(limit or config.SEARCH_PAGE_SIZE, config.HISTORY_MAX_PAGE))
+    day_to = parse_day(date_to)
+    try:
+        async with ReadSessionLocal() as session:
+            rows = await search_messages(
+                session,
+                q,
+                user_id=user_id,
+                date_from=parse_day(date_from),
+                date_to=day_to + timedelta(days=1) if day_to else None,  # включая весь день
+                media_type=media_type or None,
+                status=status or None,
+                sort=sort,
+                after=decode_search_cursor(cursor),
+                limit=limit + 1,
+            )
+    except OperationalError as e:
+        print(f"[search] query failed: {e}")
+        return JSONResponse({"ok": False, "error": "search_unavailable"}, status_code=400)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_search_cursor(None if sort == "date" else last.rank, last.id)
+
+    return JSONResponse({
+        "ok": True,
+        "results": [
+            {
+                "id": r.id,
+                "user_id": r.user_id,
+                "username": r.username,
+                "created_at": r.created_at.isoformat() if r.created_at else None,
+                "media_type": r.media_type,
+                "status": r.status,
+                "snippet_html": snippet_html(r.snippet),
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor,
+    })
 
 
 # ------------------ Delete single message ------------------
 
-@router.post("/delete_msg")
+@router.post("/delete_msg", dependencies=[Depends(admin_api)])
 async def delete_msg(user_id: int = Form(...), msg_id: int = Form(...)):
-    async with SessionLocal() as session:
+    async with ReadSessionLocal() as session:
         msg = await get_message_by_id(session, int(msg_id))
-        if not msg:
-            return JSONResponse({"ok": False, "error": "not_found"}, status_code=200)
+    if not msg:
+        return JSONResponse({"ok": False, "error": "not_found"}, status_code=200)
 
-        try:
-            if msg.tg_message_id:
-                await bot.delete_message(user_id, msg.tg_message_id)
-        except Exception as e:
-            print(f"[delete_msg] Telegram delete failed: {e}")
+    # вызов Telegram — вне транзакции, чтобы не держать соединение писателя
+    try:
+        if msg.tg_message_id:
+            await outbox.call(None, bot.delete_message, user_id, msg.tg_message_id)
+    except Exception as e:
+        print(f"[delete_msg] Telegram delete failed: {e}")
 
-        msg.status = "deleted"
+    async with SessionLocal() as session:
+        await mark_messages_deleted(session, [msg.id])
         await session.commit()
 
-        await send_to_user_ws(user_id, {
-            "action": "status_update",
-            "msg_id": msg.id,
-            "status": "deleted",
-        })
+    await queue_status(user_id, msg.id, "deleted")
 
     return JSONResponse({"ok": True, "deleted": True})
 
@@ -175,17 +442,37 @@ async def delete_msg(user_id: int = Form(...), msg_id: int = Form(...)):
 
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: int):
+    if not is_authed(websocket):
+        await websocket.close(code=1008)
+        return
     await websocket.accept()
-    await register_ws(user_id, websocket)
+    conn = await register_ws(user_id, websocket)
 
     async def update_status(msg_id: int, new_status: str):
         async with SessionLocal() as session:
             await update_message_status(session, msg_id, new_status)
-        await send_to_user_ws(user_id, {
-            "action": "status_update",
-            "msg_id": msg_id,
-            "status": new_status,
-        })
+        await queue_status(user_id, msg_id, new_status)
+
+    async def report_clear_progress(done: int, total: int, ids: List[int]):
+        await queue_statuses(user_id, {mid: "deleted" for mid in ids})
+        await send_to_user_ws(user_id, {"action": "clear_progress", "done": done, "total": total})
+
+    async def clear_history():
+        try:
+            async with ReadSessionLocal() as session:
+                msgs = await get_deletable_messages(session, user_id)
+
+            await send_to_user_ws(user_id, {"action": "clear_progress", "done": 0, "total": len(msgs)})
+            async with SessionLocal() as session:
+                await delete_user_history(bot, session, user_id, msgs, report_clear_progress)
+            await send_to_user_ws(
+                user_id,
+                {"action": "clear_progress", "done": len(msgs), "total": len(msgs), "finished": True},
+            )
+        except Exception as e:
+            print(f"[clear_history] error: {e}")
+
+    clear_task: Optional[asyncio.Task] = None
 
     try:
         while True:
@@ -233,21 +520,21 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                         caption = text or None
                         send_kwargs = {"caption": caption} if caption else {}
                         if media_type == "photo":
-                            sent = await bot.send_photo(int(user_id), file_id, **send_kwargs)
+                            sent = await outbox.send("send_photo", int(user_id), file_id, **send_kwargs)
                             new_file_id = sent.photo[-1].file_id if sent.photo else file_id
                         elif media_type == "video":
-                            sent = await bot.send_video(int(user_id), file_id, **send_kwargs)
+                            sent = await outbox.send("send_video", int(user_id), file_id, **send_kwargs)
                             new_file_id = sent.video.file_id if getattr(sent, "video", None) else file_id
                         elif media_type == "voice":
-                            sent = await bot.send_voice(int(user_id), file_id, **send_kwargs)
+                            sent = await outbox.send("send_voice", int(user_id), file_id, **send_kwargs)
                             voice_obj = getattr(sent, "voice", None)
                             new_file_id = voice_obj.file_id if voice_obj else file_id
                         elif media_type == "audio":
-                            sent = await bot.send_audio(int(user_id), file_id, **send_kwargs)
+                            sent = await outbox.send("send_audio", int(user_id), file_id, **send_kwargs)
                             audio_obj = getattr(sent, "audio", None)
                             new_file_id = audio_obj.file_id if audio_obj else file_id
                         else:
-                            sent = await bot.send_document(int(user_id), file_id, **send_kwargs)
+                            sent = await outbox.send("send_document", int(user_id), file_id, **send_kwargs)
                             doc_obj = getattr(sent, "document", None)
                             new_file_id = doc_obj.file_id if doc_obj else file_id
 
@@ -261,7 +548,7 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                                 db_msg.file_id = new_file_id
                                 await session.commit()
                     else:
-                        sent = await bot.send_message(int(user_id), text)
+                        sent = await outbox.send("send_message", int(user_id), text)
                         tg_id = getattr(sent, "message_id", 0)
 
                         async with SessionLocal() as session:
@@ -277,73 +564,175 @@ async def websocket_endpoint(websocket: WebSocket, user_id: int):
                     await update_status(msg.id, "failed")
 
             elif action == "clear_history":
+                # удаление идёт в фоне, цикл приёма сокета не блокируется
+                if clear_task is None or clear_task.done():
+                    clear_task = asyncio.create_task(clear_history())
+
+            elif action == "resume":
+                # докачка пропущенного после переподключения
                 try:
-                    async with SessionLocal() as session:
-                        msgs = await get_user_messages(session, user_id)
+                    since = int(data.get("seq") or 0)
+                except (TypeError, ValueError):
+                    since = 0
+                async with ReadSessionLocal() as session:
+                    changes, last = await changes_since(session, user_id, since)
+                if changes is None:
+                    frame = {"action": "resync", "reload": True, "seq": last}
+                else:
+                    frame = {"action": "resync", "changes": changes, "seq": last}
+                conn.offer(json.dumps(frame))
 
-                        for msg in msgs:
-                            try:
-                                if msg.tg_message_id:
-                                    await bot.delete_message(user_id, msg.tg_message_id)
-                            except Exception as e:
-                                print(f"[clear_history] Telegram delete failed: {e}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await unregister_ws(conn)
 
-                            msg.status = "deleted"
 
-                        await session.commit()
+@router.websocket("/ws_feed")
+async def websocket_feed(websocket: WebSocket):
+    """Общая лента событий всех диалогов (для списка чатов)."""
+    if not is_authed(websocket):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    conn = await register_feed(websocket)
+    try:
+        while True:
+            await websocket.receive_text()  # только ping от клиента
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await unregister_ws(conn)
 
-                    # отправляем клиенту обновления статусов
-                    for msg in msgs:
-                        await send_to_user_ws(user_id, {
-                            "action": "status_update",
-                            "msg_id": msg.id,
-                            "status": "deleted",
-                        })
 
-                except Exception as e:
-                    print(f"[clear_history] error: {e}")
+# ------------------ Upload admin files ------------------
 
-    except WebSocketDisconnect:
-        await unregister_ws(user_id)
+# поля формы и границы multipart сверх самих файлов
+FORM_OVERHEAD = 64 * 1024
 
 
-# ------------------ Upload admin files ------------------
+class UploadTooLarge(HTTPException):
+    """Тело загрузки превысило лимит уже во время чтения (chunked или неверный Content-Length)."""
+
+    def __init__(self):
+        super().__init__(status_code=413)
 
-@router.post("/upload_admin_file")
+
+async def upload_too_large_handler(request: Request, exc: UploadTooLarge):
+    return JSONResponse({"ok": False, "error": "too_large"}, status_code=413)
+
+
+def upload_limit(path: str) -> Optional[int]:
+    """Предел тела запроса для маршрутов с файлами (None — не ограничиваем)."""
+    if path == "/upload_admin_file":
+        return config.UPLOAD_MAX_FILES * config.UPLOAD_MAX_BYTES + FORM_OVERHEAD
+    if path == "/api/campaigns":
+        return config.UPLOAD_MAX_BYTES + FORM_OVERHEAD
+    return None
+
+
+class UploadSizeLimit:
+    """
+    ASGI-middleware: ограничивает тело загрузок до разбора multipart — иначе
+    Starlette успевает целиком сохранить его во временные файлы. Отказ сразу
+    по Content-Length, а без него — как только прочитано больше лимита.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = upload_limit(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            response = JSONResponse({"ok": False, "error": "too_large"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise UploadTooLarge()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+@router.post("/upload_admin_file", dependencies=[Depends(admin_api)])
 async def upload_admin_file(
     user_id: int = Form(...),
     files: List[UploadFile] = File(...),
     album: bool = Form(False),
+    upload_id: Optional[str] = Form(None),
 ):
-    os.makedirs("media", exist_ok=True)
     saved_files = []
+    errors = []
     temp_items = []
 
-    def detect_media_type(upload: UploadFile, file_path: str) -> str:
-        mime = upload.content_type or mimetypes.guess_type(upload.filename or "")[0]
-        if not mime:
-            mime = mimetypes.guess_type(file_path)[0]
-
-        if mime and mime.startswith("image/"):
-            return "photo"
-        if mime and mime.startswith("video/"):
-            return "video"
-        if mime and mime.startswith("audio/"):
-            return "voice" if "ogg" in mime else "audio"
-        return "document"
+    async def progress(index: int, stage: str, **extra):
+        """Статус отдельного файла в сокет диалога (received / sending / sent / failed / rejected)."""
+        if upload_id:
+            await send_to_user_ws(user_id, {
+                "action": "upload_progress",
+                "upload_id": upload_id,
+                "index": index,
+                "stage": stage,
+                **extra,
+            })
+
+    for index, f in enumerate(files):
+        if f.size is not None and f.size > config.UPLOAD_MAX_BYTES:
+            errors.append({"index": index, "error": "too_large"})
+            await progress(index, "rejected", error="too_large")
+            continue
+
+        sha256, size = await hash_upload(f)
+        if size < 0:
+            errors.append({"index": index, "error": "too_large"})
+            await progress(index, "rejected", error="too_large")
+            continue
 
-    for f in files:
         ext = os.path.splitext(f.filename or "")[1]
         tmp_name = f"{uuid4().hex}{ext}"
-        file_path = os.path.join("media", tmp_name)
-        with open(file_path, "wb") as out:
-            out.write(await f.read())
-
-        media_type = detect_media_type(f, file_path)
-        temp_items.append({
-            "path": file_path,
+        media_type = detect_media_type(f, tmp_name)
+        UPLOAD_BYTES.observe(size, media_type)
+        async with ReadSessionLocal() as session:
+            cached_id = await get_media_file_id(session, sha256, media_type)
+
+        item = {
+            "index": index,
+            "upload": f,
+            "tmp_name": tmp_name,
+            "sha256": sha256,
+            "size": size,
             "media_type": media_type,
-        })
+            "file_id": cached_id,  # уже загружен — отправим по file_id без аплоада
+        }
+        temp_items.append(item)
+        await progress(index, "received", bytes=size, cached=cached_id is not None)
+
+    def input_for(item):
+        # файл отправляется прямо из спула запроса: отправка идёт, пока запрос открыт
+        return item["file_id"] or UploadInputFile(item["upload"], item["tmp_name"])
+
+    async def remember(item, file_id: str):
+        if not file_id:
+            return
+        async with SessionLocal() as session:
+            await remember_media_file(session, item["sha256"], item["media_type"], file_id, item["size"])
+
+    async def restage(item):
+        """Сохранённый file_id отвергнут Telegram — забываем его и загружаем файл заново."""
+        async with SessionLocal() as session:
+            await forget_media_file(session, item["sha256"], item["media_type"])
+        item["file_id"] = None
 
     async def persist_and_broadcast(media_type: str, file_id: str, tg_id: int):
         async with SessionLocal() as session:
@@ -367,68 +756,69 @@ async def upload_admin_file(
                 "media_type": media_type,
                 "file_id": file_id,
                 "text": "",
-                "created_at": datetime.utcnow().isoformat(),
+                "created_at": msg.created_at.isoformat(),
                 "id": msg.id,
                 "status": "delivered",
             },
         )
 
-        saved_files.append({"id": file_id, "type": media_type})
+        saved_files.append({"id": file_id, "type": media_type, "msg_id": msg.id})
 
     async def send_single(item):
-        input_file = FSInputFile(item["path"])
         media_type = item["media_type"]
-
-        if media_type == "photo":
-            sent = await bot.send_photo(user_id, input_file)
-            file_id = sent.photo[-1].file_id if sent.photo else ""
-        elif media_type == "video":
-            sent = await bot.send_video(user_id, input_file)
-            file_id = sent.video.file_id if getattr(sent, "video", None) else ""
-        elif media_type == "voice":
-            sent = await bot.send_voice(user_id, input_file)
-            voice_obj = getattr(sent, "voice", None)
-            file_id = voice_obj.file_id if voice_obj else ""
-        elif media_type == "audio":
-            sent = await bot.send_audio(user_id, input_file)
-            audio_obj = getattr(sent, "audio", None)
-            file_id = audio_obj.file_id if audio_obj else ""
-        else:
-            sent = await bot.send_document(user_id, input_file)
-            doc_obj = getattr(sent, "document", None)
-            file_id = doc_obj.file_id if doc_obj else ""
-
-        await persist_and_broadcast(media_type, file_id, sent.message_id)
+        method = SEND_METHODS.get(media_type, "send_document")
+        await progress(item["index"], "sending")
 
         try:
-            os.remove(item["path"])
-        except OSError:
-            pass
+            try:
+                sent = await outbox.send(method, user_id, input_for(item))
+            except TelegramBadRequest:
+                if item["file_id"] is None:
+                    raise
+                await restage(item)
+                sent = await outbox.send(method, user_id, input_for(item))
+
+            file_id = sent_file_id(sent, media_type)
+            await remember(item, file_id)
+            await persist_and_broadcast(media_type, file_id, sent.message_id)
+            await progress(item["index"], "sent")
+        except Exception as e:
+            print(f"[upload_admin_file] send failed: {e}")
+            errors.append({"index": item["index"], "error": "send_failed"})
+            await progress(item["index"], "failed", error="send_failed")
 
     async def send_album_group(chunk):
-        media_inputs = []
-        for entry in chunk:
-            fs_file = FSInputFile(entry["path"])
-            if entry["media_type"] == "photo":
-                media_inputs.append(InputMediaPhoto(media=fs_file))
-            else:
-                media_inputs.append(InputMediaVideo(media=fs_file))
-
-        sent_messages = await bot.send_media_group(user_id, media_inputs)
-        for sent, entry in zip(sent_messages, chunk):
-            if entry["media_type"] == "photo" and sent.photo:
-                file_id = sent.photo[-1].file_id
-            elif entry["media_type"] == "video" and getattr(sent, "video", None):
-                file_id = sent.video.file_id
-            else:
-                file_id = ""
+        def build_media():
+            return [
+                InputMediaPhoto(media=input_for(entry)) if entry["media_type"] == "photo"
+                else InputMediaVideo(media=input_for(entry))
+                for entry in chunk
+            ]
 
-            await persist_and_broadcast(entry["media_type"], file_id, sent.message_id)
+        for entry in chunk:
+            await progress(entry["index"], "sending")
 
+        try:
             try:
-                os.remove(entry["path"])
-            except OSError:
-                pass
+                sent_messages = await outbox.send("send_media_group", user_id, build_media(), cost=len(chunk))
+            except TelegramBadRequest:
+                cached = [entry for entry in chunk if entry["file_id"] is not None]
+                if not cached:
+                    raise
+                for entry in cached:
+                    await restage(entry)
+                sent_messages = await outbox.send("send_media_group", user_id, build_media(), cost=len(chunk))
+
+            for sent, entry in zip(sent_messages, chunk):
+                file_id = sent_file_id(sent, entry["media_type"])
+                await remember(entry, file_id)
+                await persist_and_broadcast(entry["media_type"], file_id, sent.message_id)
+                await progress(entry["index"], "sent")
+        except Exception as e:
+            print(f"[upload_admin_file] album send failed: {e}")
+            for entry in chunk:
+                errors.append({"index": entry["index"], "error": "send_failed"})
+                await progress(entry["index"], "failed", error="send_failed")
 
     can_send_album = (
         album
@@ -437,6 +827,7 @@ async def upload_admin_file(
     )
 
     if can_send_album:
+        # порядок внутри альбома важен — группы уходят последовательно
         for i in range(0, len(temp_items), 10):
             chunk = temp_items[i : i + 10]
             if len(chunk) > 1:
@@ -444,8 +835,124 @@ async def upload_admin_file(
             else:
                 await send_single(chunk[0])
     else:
-        for item in temp_items:
-            await send_single(item)
+        # независимые файлы отправляем параллельно, но не больше UPLOAD_SEND_CONCURRENCY
+        sem = asyncio.Semaphore(config.UPLOAD_SEND_CONCURRENCY)
+
+        async def send_limited(item):
+            async with sem:
+                await send_single(item)
+
+        await asyncio.gather(*(send_limited(item) for item in temp_items))
+
+    return {"ok": bool(saved_files) or not errors, "files": saved_files, "errors": errors}
+
 
-    return {"ok": True, "files": saved_files}
+# ------------------ Campaigns (mass mailing) ------------------
 
+CAPTION_LIMIT = 1024
+TEXT_LIMIT = 4096
+
+
+@router.get("/campaigns", response_class=HTMLResponse, dependencies=[Depends(admin_page)])
+async def campaigns_page():
+    async with ReadSessionLocal() as session:
+        rows = await get_campaigns(session)
+
+    tpl = env.get_template("campaigns.html")
+    return HTMLResponse(await tpl.render_async(campaigns=[campaign_runner.describe(c) for c in rows]))
+
+
+@router.get("/api/campaigns", dependencies=[Depends(admin_api)])
+async def campaigns_progress():
+    async with ReadSessionLocal() as session:
+        rows = await get_campaigns(session)
+    return JSONResponse({"ok": True, "campaigns": [campaign_runner.describe(c) for c in rows]})
+
+
+@router.post("/api/campaigns", dependencies=[Depends(admin_api)])
+async def create_campaign_endpoint(
+    text: str = Form(""),
+    file: Optional[UploadFile] = File(None),
+):
+    text = text.strip()
+    has_file = file is not None and bool(file.filename)
+    if not text and not has_file:
+        return JSONResponse({"ok": False, "error": "empty"}, status_code=400)
+    if len(text) > (CAPTION_LIMIT if has_file else TEXT_LIMIT):
+        return JSONResponse({"ok": False, "error": "text_too_long"}, status_code=400)
+
+    media_type = file_id = media_path = sha256 = None
+    if has_file:
+        sha256, size = await hash_upload(file)
+        if size < 0:
+            return JSONResponse({"ok": False, "error": "too_large"}, status_code=400)
+        ext = os.path.splitext(file.filename or "")[1]
+        media_path = os.path.join(config.UPLOAD_DIR, f"campaign_{uuid4().hex}{ext}")
+        media_type = detect_media_type(file, media_path)
+        UPLOAD_BYTES.observe(size, media_type)
+
+        async with ReadSessionLocal() as session:
+            file_id = await get_media_file_id(session, sha256, media_type)
+        if file_id:
+            media_path = None  # уже есть в Telegram — на диск не пишем
+        else:
+            os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+            await stage_to_disk(file, media_path)
+
+    async with SessionLocal() as session:
+        campaign = await create_campaign(
+            session, text, media_type=media_type, file_id=file_id,
+            media_path=media_path, sha256=sha256,
+        )
+    campaign_runner.wake()
+    return JSONResponse({"ok": True, "campaign": campaign_runner.describe(campaign)})
+
+
+@router.post("/api/campaigns/{campaign_id}/{action}", dependencies=[Depends(admin_api)])
+async def campaign_action(campaign_id: int, action: str):
+    transitions = {
+        "pause": ("paused", ("running",)),
+        "resume": ("running", ("paused",)),
+        "cancel": ("cancelled", ("running", "paused")),
+    }
+    if action not in transitions:
+        return JSONResponse({"ok": False, "error": "unknown_action"}, status_code=400)
+
+    status, from_statuses = transitions[action]
+    async with SessionLocal() as session:
+        changed = await set_campaign_status(session, campaign_id, status, from_statuses)
+        campaign = await get_campaign(session, campaign_id)
+    if campaign is None:
+        return JSONResponse({"ok": False, "error": "not_found"}, status_code=404)
+    if action == "resume":
+        campaign_runner.wake()
+    if action == "cancel" and changed:
+        remove_file(campaign.media_path)  # до первой загрузки файл лежит на диске
+    return JSONResponse({"ok": changed, "campaign": campaign_runner.describe(campaign)})
+
+
+# ------------------ SQL trace ------------------
+
+@router.get("/sql", response_class=HTMLResponse, dependencies=[Depends(admin_page)])
+async def sql_page(sort: str = "total"):
+    tpl = env.get_template("sql.html")
+    return HTMLResponse(await tpl.render_async(
+        enabled=config.SQL_TRACE,
+        rows=tracer.top(config.SQL_TRACE_TOP, sort),
+        sort=sort,
+        statements=len(tracer.stats),
+        slow_ms=config.SQL_SLOW_MS,
+        since=datetime.utcfromtimestamp(tracer.started_at).strftime("%Y-%m-%d %H:%M:%S UTC"),
+    ))
+
+
+@router.get("/api/sql", dependencies=[Depends(admin_api)])
+async def sql_top(sort: str = "total", limit: Optional[int] = None):
+    limit = max(1, min(limit or config.SQL_TRACE_TOP, config.SQL_TRACE_MAX_STATEMENTS))
+    return JSONResponse({"ok": True, "enabled": config.SQL_TRACE, "statements": tracer.top(limit, sort)})
+
+
+@router.post("/api/sql/reset", dependencies=[Depends(admin_api)])
+async def sql_reset():
+    tracer.reset()
+    return JSONResponse({"ok": True})
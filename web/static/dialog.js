@@ -1,4 +1,4 @@
-// userId, ADMIN_NAME, messages приходят из dialog.html
+// userId, ADMIN_NAME, messages, nextCursor приходят из dialog.html
 
 const chatRoot = document.querySelector('.chat');
 const messagesDiv = document.getElementById('messages');
@@ -16,6 +16,7 @@ let previewFiles = [];  // файлы, ожидающие отправки
 let ws, reconnectTimer, pingInterval;
 let sending = false;
 let dragDepth = 0;
+let loadingOlder = false;
 
 const WS_PATH =
   (location.protocol === "https:" ? "wss://" : "ws://") +
@@ -67,6 +68,11 @@ function renderAll() {
 }
 
 function renderOne(m) {
+  messagesDiv.appendChild(buildMessageEl(m));
+  scrollBottom();
+}
+
+function buildMessageEl(m) {
   const el = document.createElement('div');
   const isDeleted = m.status === "deleted";
   const adminName = (ADMIN_NAME || 'admin').toLowerCase();
@@ -107,12 +113,175 @@ function renderOne(m) {
     await deleteMessage(m.id);
   };
 
-  messagesDiv.appendChild(el);
-  scrollBottom();
+  return el;
+}
+
+// Применить пачку статусов {status: [id, ...]} за один проход,
+// перерисовывая только затронутые сообщения
+function applyStatuses(statuses) {
+  const byId = new Map(messages.map(m => [m.id, m]));
+  const els = new Map();
+  for (const el of messagesDiv.children) els.set(Number(el.dataset.id), el);
+
+  for (const [newStatus, ids] of Object.entries(statuses)) {
+    for (const id of ids) {
+      const msg = byId.get(id);
+      if (!msg || msg.status === newStatus) continue;
+      msg.status = newStatus;
+      const el = els.get(id);
+      if (el) el.replaceWith(buildMessageEl(msg));
+    }
+  }
+}
+
+// ---------------- History (lazy loading) ------------------
+
+async function loadOlder() {
+  if (loadingOlder || !nextCursor) return;
+  loadingOlder = true;
+  try {
+    const url = `/api/dialog/${userId}/history?before=${encodeURIComponent(nextCursor)}`;
+    const res = await fetch(url);
+    const data = await res.json();
+    if (!data.ok) return;
+
+    const known = new Set(messages.map(m => m.id));
+    const older = (data.messages || []).filter(m => !known.has(m.id));
+    nextCursor = data.next_cursor;
+
+    // вставляем сверху, сохраняя позицию прокрутки
+    const prevHeight = messagesDiv.scrollHeight;
+    const frag = document.createDocumentFragment();
+    for (const m of older) frag.appendChild(buildMessageEl(m));
+    messagesDiv.insertBefore(frag, messagesDiv.firstChild);
+    messages = older.concat(messages);
+    messagesDiv.scrollTop += messagesDiv.scrollHeight - prevHeight;
+  } catch (e) {
+    console.error('Cannot load history', e);
+  } finally {
+    loadingOlder = false;
+  }
+  fillViewport();
+}
+
+// догружаем, пока история не заполнит окно (иначе не будет события scroll)
+function fillViewport() {
+  if (nextCursor && messagesDiv.scrollHeight <= messagesDiv.clientHeight) loadOlder();
 }
 
+messagesDiv.addEventListener('scroll', () => {
+  if (messagesDiv.scrollTop < 200) loadOlder();
+});
+
 // ---------------- WebSocket ------------------
 
+let resuming = false;
+let pendingFrames = [];
+
+// seq, применённые после lastSeq (seq → когда получен). Кадры из разных
+// процессов (бот и веб) приходят не строго по порядку seq, поэтому
+// «seq <= последнего» не значит «уже применено». Запоздать кадр может лишь
+// на несколько опросов шины — всё, что старше SEQ_REORDER_MS, сворачивается
+// в lastSeq, и докачка после обрыва идёт от свежего seq.
+const SEQ_WINDOW = 200;
+const SEQ_REORDER_MS = 5000;
+// тихий диалог сам не двигает lastSeq — раз в RESUME_INTERVAL_MS сверяемся
+// с сервером, чтобы lastSeq не отстал от журнала (CHANGES_RETENTION)
+const RESUME_INTERVAL_MS = 10 * 60 * 1000;
+let appliedSeqs = new Map();
+let lastResumeAt = 0;
+
+function seqApplied(seq) {
+  return seq <= lastSeq || appliedSeqs.has(seq);
+}
+
+function rememberSeq(seq) {
+  appliedSeqs.set(seq, Date.now());
+  foldSeqs();
+  if (appliedSeqs.size > SEQ_WINDOW) {
+    // самый старый из окна считаем границей: такие запоздавшие кадры уже не ждём
+    advanceLastSeq(Math.min(...appliedSeqs.keys()));
+  }
+}
+
+function foldSeqs() {
+  const cutoff = Date.now() - SEQ_REORDER_MS;
+  let settled = lastSeq;
+  for (const [seq, at] of appliedSeqs) {
+    if (at < cutoff && seq > settled) settled = seq;
+  }
+  advanceLastSeq(settled);
+}
+
+function advanceLastSeq(seq) {
+  if (seq <= lastSeq) return;
+  lastSeq = seq;
+  for (const s of [...appliedSeqs.keys()]) {
+    if (s <= lastSeq) appliedSeqs.delete(s);
+  }
+}
+
+function sendResume() {
+  // докачать всё, что случилось после lastSeq; живые кадры ждут ответа в pendingFrames
+  resuming = true;
+  pendingFrames = [];
+  lastResumeAt = Date.now();
+  ws.send(JSON.stringify({action: 'resume', seq: lastSeq}));
+}
+
+function handleFrame(data) {
+  if (data.seq) {
+    if (seqApplied(data.seq)) return;  // уже применено (из resync или повторно)
+    rememberSeq(data.seq);
+  }
+
+  if (data.action === 'message') {
+    const msg = {
+      id: data.id ?? Date.now(),
+      username: data.username || (data.from === 'admin' ? ADMIN_NAME : 'user'),
+      text: data.text || '',
+      created_at: data.created_at || new Date().toISOString(),
+      status: data.status || 'delivered',
+      media_type: data.media_type || null,
+      file_id: data.file_id || null
+    };
+    // сообщение могло уже прийти (ответ загрузки или повторная доставка)
+    if (!messages.some(m => m.id === msg.id)) {
+      messages.push(msg);
+      renderOne(msg);
+    }
+
+  } else if (data.action === 'status_update') {
+    applyStatuses({[data.status]: [data.msg_id]});
+  } else if (data.action === 'status_batch') {
+    applyStatuses(data.statuses || {});
+  } else if (data.action === 'upload_progress') {
+    applyUploadProgress(data);
+  } else if (data.action === 'clear_progress') {
+    status.textContent = data.finished
+      ? 'Онлайн'
+      : `Удаление истории: ${data.done} / ${data.total}`;
+  } else if (data.action === 'cleared') {
+    messages = [];
+    renderAll();
+  }
+}
+
+function applyResync(data) {
+  if (data.reload) {
+    // разрыв старше журнала изменений — только полная перезагрузка
+    location.reload();
+    return;
+  }
+  (data.changes || []).forEach(handleFrame);
+  pendingFrames.forEach(handleFrame);
+  pendingFrames = [];
+  resuming = false;
+  // все изменения диалога до data.seq пришли в changes (запись журнала
+  // последовательна) — ниже этой границы ждать нечего
+  advanceLastSeq(data.seq);
+}
+
 function connectWS() {
   status.textContent = 'Подключение...';
   ws = new WebSocket(WS_PATH);
@@ -120,12 +289,15 @@ function connectWS() {
 
   ws.onopen = () => {
     status.textContent = 'Онлайн';
-    ws.send(JSON.stringify({action:'ping'}));
+    // пропущенное после рендера страницы или обрыва
+    sendResume();
 
     if (pingInterval) clearInterval(pingInterval);
     pingInterval = setInterval(() => {
-      if (ws.readyState === WebSocket.OPEN)
-        ws.send(JSON.stringify({action:'ping'}));
+      foldSeqs();
+      if (ws.readyState !== WebSocket.OPEN) return;
+      ws.send(JSON.stringify({action:'ping'}));
+      if (!resuming && Date.now() - lastResumeAt > RESUME_INTERVAL_MS) sendResume();
     }, 20000);
   };
 
@@ -133,30 +305,14 @@ function connectWS() {
     try {
       const data = JSON.parse(ev.data);
 
-      if (data.action === 'message') {
-        const msg = {
-          id: data.id ?? Date.now(),
-          username: data.username || (data.from === 'admin' ? ADMIN_NAME : 'user'),
-          text: data.text || '',
-          created_at: data.created_at || new Date().toISOString(),
-          status: data.status || 'delivered',
-          media_type: data.media_type || null,
-          file_id: data.file_id || null
-        };
-        messages.push(msg);
-        renderOne(msg);
-
-      } else if (data.action === 'status_update') {
-        const msg = messages.find(m => m.id === data.msg_id);
-        if (msg) {
-          msg.status = data.status;
-          renderAll();
-        }
-      } else if (data.action === 'cleared') {
-        messages = [];
-        renderAll();
+      if (data.action === 'resync') {
+        applyResync(data);
+      } else if (resuming && data.seq) {
+        // живые кадры ждут, пока не применится пакет пропущенных (порядок по seq)
+        pendingFrames.push(data);
+      } else {
+        handleFrame(data);
       }
-
     } catch (e) {
       console.error("WS error", e);
     }
@@ -179,9 +335,7 @@ async function deleteMessage(msgId) {
   const data = await res.json();
 
   if (data.ok) {
-    const msg = messages.find(m => m.id === msgId);
-    if (msg) msg.status = "deleted";
-    renderAll();
+    applyStatuses({deleted: [msgId]});
   }
 }
 
@@ -292,11 +446,32 @@ function splitUploadGroups(queue) {
   return groups;
 }
 
+// upload_id → элементы превью этой загрузки (для upload_progress с сервера)
+const activeUploads = new Map();
+
+const UPLOAD_STAGES = {
+  received: ['Получено', null],
+  sending: ['Отправка…', null],
+  sent: ['Отправлено', 'done'],
+  failed: ['Ошибка', 'error'],
+  rejected: ['Слишком большой', 'error'],
+};
+
+function applyUploadProgress(data) {
+  const items = activeUploads.get(data.upload_id);
+  const item = items && items[data.index];
+  const stage = UPLOAD_STAGES[data.stage];
+  if (item && stage) setPreviewStatus(item, stage[0], stage[1]);
+}
+
 async function uploadBatch(items) {
   return new Promise((resolve) => {
     const xhr = new XMLHttpRequest();
     const fd = new FormData();
+    const uploadId = makePreviewId();
+    activeUploads.set(uploadId, items);
     fd.append("user_id", userId);
+    fd.append("upload_id", uploadId);
     const isAlbum = items.length > 1 && items.every(it => isAlbumFile(it.file));
     if (isAlbum) {
       fd.append('album', '1');
@@ -318,13 +493,19 @@ async function uploadBatch(items) {
     };
 
     xhr.onload = () => {
+      activeUploads.delete(uploadId);
       let data = {};
       try {
         data = JSON.parse(xhr.responseText);
       } catch {}
 
       if (data.ok && data.files?.length) {
-        items.forEach(item => {
+        const failed = new Set((data.errors || []).map(e => e.index));
+        items.forEach((item, idx) => {
+          if (failed.has(idx)) {
+            setPreviewStatus(item, "Ошибка", "error");
+            return;
+          }
           item.uploaded = true;
           setPreviewStatus(item, "Отправлено", "done");
           setTimeout(() => {
@@ -345,7 +526,7 @@ async function uploadBatch(items) {
             media_type: meta.type || null,
             file_id: meta.id || null,
           };
-          if (message.file_id) {
+          if (message.file_id && !messages.some(m => m.id === message.id)) {
             messages.push(message);
             renderOne(message);
           }
@@ -361,6 +542,7 @@ async function uploadBatch(items) {
     };
 
     xhr.onerror = () => {
+      activeUploads.delete(uploadId);
       items.forEach(item => setPreviewStatus(item, "Ошибка", "error"));
       resolve(false);
     };
@@ -487,7 +669,7 @@ clearBtn.addEventListener('click', ()=> {
 backBtn.addEventListener('click', ()=> window.location.href='/');
 connectWS();
 renderAll();
-scrollBottom();
+scrollBottom().then(fillViewport);
 function makePreviewId() {
   if (window.crypto && typeof window.crypto.randomUUID === 'function') {
     return window.crypto.randomUUID();